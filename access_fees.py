@@ -1,156 +1,265 @@
-from creds import db_connection_string
-from typing import Dict, List, Union
+from data_loader import BaseData, load_base_data, get_engine
+from billing_history import read_billing_history, closed_access_fees, closed_months
+from fee_schedule import FeeSchedule, load_fee_schedules, schedule_in_effect, lookup_access_rates_by_month
+from creds import access_aggregation_mode
+from typing import List, Union
 from sqlalchemy import text
+from profiling import profiled
 import sqlalchemy as sql
 import pandas as pd
 import datetime
 import calendar
 
+NEW_ACCESSES_PER_DAY_QUERY = """SELECT
+  fl.data_category AS data_category,
+  u.security AS security,
+  r.day AS timestamp,
+  COUNT(DISTINCT r.dataset_id) - 1 AS id
+FROM
+  (SELECT DISTINCT DATE(timestamp) AS day, dataset_id FROM requests
+   WHERE timestamp >= :date_from AND timestamp < :date_to) r
+  JOIN datasets d ON r.dataset_id = d.id
+  JOIN field_lists fl ON d.field_listid = fl.id
+  JOIN universes u ON u.id = d.universeid
+GROUP BY
+  fl.data_category, u.security, r.day
+HAVING
+  COUNT(DISTINCT r.dataset_id) > 1
+ORDER BY
+  fl.data_category, u.security, r.day
+"""
+
+# covering indexes for the pushdown query, requests is range scanned on timestamp and datasets is probed by id
+RECOMMENDED_INDEXES = {
+    "requests": {"ix_requests_timestamp_dataset_id_success": ["timestamp", "dataset_id", "success"]},
+    "datasets": {"ix_datasets_id_universeid_field_listid": ["id", "universeid", "field_listid"]},
+}
+
+
+def create_recommended_indexes(engine: Union[sql.engine.Engine, None] = None) -> List[str]:
+    engine = engine if engine is not None else get_engine()
+    created = []
+
+    with engine.begin() as conn:
+        inspector = sql.inspect(conn)
+        for table, indexes in RECOMMENDED_INDEXES.items():
+            existing = {index['name'] for index in inspector.get_indexes(table)}
+            for name, columns in indexes.items():
+                if name not in existing:
+                    conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+                    created.append(name)
+
+    return created
+
+
+def restrict_to_date_range(request_table: pd.DataFrame, date_from: Union[datetime.date, None],
+                           date_to: Union[datetime.date, None]) -> pd.DataFrame:
+    if date_from is not None:
+        request_table = request_table.loc[request_table['timestamp'] >= pd.Timestamp(date_from)]
+    if date_to is not None:
+        request_table = request_table.loc[request_table['timestamp'] < pd.Timestamp(date_to)]
+    return request_table
+
+
+@profiled("access.merge")
+def calculate_number_of_new_accesses_per_day(datasets: pd.DataFrame, request_table: pd.DataFrame,
+                                             date_from: Union[datetime.date, None] = None,
+                                             date_to: Union[datetime.date, None] = None) -> pd.DataFrame:
+    # need to get the securities by data category by day (join in mysql takes too long)
+    request_table = restrict_to_date_range(request_table, date_from, date_to)
 
-def dataset_connector() -> (pd.DataFrame, pd.DataFrame):
-    engine = sql.create_engine(db_connection_string)
-
-    with engine.connect() as conn:
-        requests = pd.read_sql(text("SELECT timestamp, dataset_id FROM requests"), conn)
-        datasets = pd.read_sql(text(
-            "SELECT d.id as id, u.security as security, fl.data_category as data_category from datasets d "
-            "JOIN field_lists fl ON d.field_listid=fl.id JOIN universes u ON u.id=d.universeid"),
-            conn)
+    # only one row per dataset per day matters for the distinct count, so drop repeats before fanning out to securities
+    request_days = pd.DataFrame({'timestamp': request_table['timestamp'].dt.normalize(),
+                                 'dataset_id': request_table['dataset_id']}).drop_duplicates()
+    datasets = pd.merge(request_days, datasets[['id', 'security', 'data_category']], how='inner',
+                        left_on='dataset_id', right_on='id')
 
-        engine.dispose()
+    # count the unique datasets by day excluding the initial one, days stay datetime64 so nothing downstream has to
+    # walk python date objects. observed keeps categorical keys to the combinations that actually occur
+    datasets = datasets.groupby(by=['data_category', 'security', 'timestamp'], observed=True)['id'].nunique() \
+        .reset_index()
+    datasets['id'] = datasets['id'] - 1
 
-    return datasets, requests
+    return datasets.loc[datasets['id'] > 0].copy().reset_index(drop=True)
 
 
-def calculate_number_of_new_accesses_per_day(datasets: pd.DataFrame, request_table: pd.DataFrame) -> pd.DataFrame:
-    # need to get the securities by data category by day (join in mysql takes too long)
-    datasets = pd.merge(request_table, datasets, how='inner', left_on='dataset_id', right_on='id')
-    datasets['timestamp'] = datasets['timestamp'].dt.date
+@profiled("access.pushdown_query")
+def query_number_of_new_accesses_per_day(engine: Union[sql.engine.Engine, None] = None,
+                                         date_from: Union[datetime.date, None] = None,
+                                         date_to: Union[datetime.date, None] = None) -> pd.DataFrame:
+    engine = engine if engine is not None else get_engine()
+    # open ended ranges fall back to bounds every timestamp sits between
+    params = {"date_from": f"{date_from or datetime.date(1970, 1, 1):%Y-%m-%d}",
+              "date_to": f"{date_to or datetime.date(9999, 12, 31):%Y-%m-%d}"}
 
-    # get number of new requests by day as well
-    datasets = datasets.groupby(by=['data_category', 'security', 'timestamp'])['id'].apply(list).reset_index()
+    with engine.connect() as conn:
+        datasets = pd.read_sql(text(NEW_ACCESSES_PER_DAY_QUERY), conn, params=params)
 
-    # count the unique datasets excluding the initial one
-    datasets['id'] = datasets['id'].apply(lambda x: len(set(x)) - 1)
+    # mysql hands back dates, sqlite hands back strings
+    datasets['timestamp'] = pd.to_datetime(datasets['timestamp'])
+    datasets['id'] = datasets['id'].astype('int64')
 
-    return datasets.loc[datasets['id'] > 0].copy().reset_index(drop=True)
+    return datasets
 
 
-def generate_new_rows(existing_fee_table: pd.DataFrame, fee_modifier: List[dict]):
-    new_row_list = []
-    # create business date range from max date of existing fee table and month end
-    date_time_converted_object = max(existing_fee_table['timestamp'])
+def remaining_business_days(date_time_converted_object: datetime.date) -> pd.DatetimeIndex:
+    # create business date range from the given day to month end, excluding the first one
     end_of_month_by_day_of_month = \
         calendar.monthrange(date_time_converted_object.year, date_time_converted_object.month)[1]
     end_of_month_date = datetime.datetime.strptime(
         f"{date_time_converted_object.year}-{date_time_converted_object.month}-{end_of_month_by_day_of_month}",
         "%Y-%m-%d")
-    business_day_range = pd.bdate_range(date_time_converted_object, end_of_month_date)[1:]
-
-    # create rows to forward fill with (default is any that fall on the most recent day)
-
-    default_rows_to_forward_fill = existing_fee_table.loc[
-        existing_fee_table['timestamp'] == max(existing_fee_table['timestamp'])].copy().to_dict("records")
-
-    # append any new rows added in the fee modifier
-    for fee_addition in fee_modifier:
-        if (security_number := fee_addition.get("Number of Securities")) > 1:
-            for i in range(security_number):
-                default_rows_to_forward_fill.append({"data_category": fee_addition["Data Category"],
-                                                     "security": "dummy",
-                                                     "id": fee_addition["Frequency per Day"]})
-
-    # gets added on to the end of the month
-    for day in business_day_range:
-        for rows in default_rows_to_forward_fill:
-            rows['timestamp'] = day.to_pydatetime()
-            new_row_list.append(rows)
-
-    # append to existing_fee_table
-    return existing_fee_table, pd.DataFrame(new_row_list)
+    return pd.bdate_range(date_time_converted_object, end_of_month_date)[1:]
+
+
+@profiled("access.projection")
+def project_month_end_access_fees(existing_fee_table: pd.DataFrame, fee_modifier: List[dict],
+                                  fee_schedules: List[FeeSchedule]) -> pd.DataFrame:
+    # forward fill to month end: the most recent day's accesses repeat on every business day left in the month,
+    # plus frequency calls a day for every security the modifier adds
+    if existing_fee_table.empty:
+        # every month with accesses is closed already and the new one has none yet, so there's no day to project from
+        return pd.DataFrame({'data_category': pd.Series(dtype=object), 'timestamp': pd.Series(dtype=object),
+                             'fee': pd.Series(dtype=float)})
+
+    last_day = existing_fee_table['timestamp'].max()
+    number_of_business_days = len(remaining_business_days(last_day))
+    access_fee_mapping = schedule_in_effect(fee_schedules, last_day).access_fee_mapping
+
+    last_day_accesses = existing_fee_table.loc[existing_fee_table['timestamp'] == last_day]
+    daily_accesses = last_day_accesses.groupby(last_day_accesses['data_category'].astype(str))['id'].sum()
+    # typed up front, an empty modifier list would otherwise leave object columns that turn the fees into objects
+    fee_additions = pd.DataFrame(fee_modifier, columns=["Data Category", "Number of Securities", "Frequency per Day"]
+                                 ).astype({"Number of Securities": float, "Frequency per Day": float})
+    fee_additions = fee_additions.loc[fee_additions['Number of Securities'] > 0]
+    added_accesses = (fee_additions['Number of Securities'] * fee_additions['Frequency per Day']).groupby(
+        fee_additions['Data Category']).sum()
+    daily_accesses = daily_accesses.add(added_accesses, fill_value=0)
+
+    projected_fees = daily_accesses * daily_accesses.index.map(access_fee_mapping).to_numpy() * number_of_business_days
+    projected_fees = projected_fees.rename_axis('data_category').rename('fee').reset_index()
+    projected_fees['timestamp'] = f"{last_day:%Y-%m}-01"
+
+    if not number_of_business_days:
+        return projected_fees.iloc[0:0]
+    return projected_fees[['data_category', 'timestamp', 'fee']]
 
 
 def transient_branching_function_map_new_rows_to_old(dataset_calling_table: pd.DataFrame,
-                                                     access_fee_mapping: Dict[str, float],
+                                                     fee_schedules: List[FeeSchedule],
                                                      fee_modifier: Union[List[dict], None] = None) -> (
-        pd.DataFrame, float):
+        pd.DataFrame, float, float):
     # add fee modification
     if fee_modifier is not None:
-        dataset_calling_table, new_rows = generate_new_rows(dataset_calling_table, fee_modifier)
+        new_rows = project_month_end_access_fees(dataset_calling_table, fee_modifier, fee_schedules)
 
-        new_rows = map_access_fees(new_rows, access_fee_mapping)
-
-        dataset_calling_table = map_access_fees(dataset_calling_table, access_fee_mapping)
-        current_fees = sum(dataset_calling_table['fee'])
-        additional_fees = sum(new_rows['fee'])
+        dataset_calling_table = map_access_fees(dataset_calling_table, fee_schedules)
+        current_fees = dataset_calling_table['fee'].sum()
+        additional_fees = new_rows['fee'].sum()
 
         dataset_calling_table = compare_and_concat_access_fees(dataset_calling_table, new_rows)
 
         return dataset_calling_table, current_fees, additional_fees
 
     # access the fee table
-    dataset_calling_table = map_access_fees(dataset_calling_table, access_fee_mapping)
-    access_fees = sum(dataset_calling_table['fee'])
-    dataset_calling_table['fee'] = dataset_calling_table['fee'].apply(lambda i: f"${i:,.2f}")
+    dataset_calling_table = map_access_fees(dataset_calling_table, fee_schedules)
+    access_fees = dataset_calling_table['fee'].sum()
+    dataset_calling_table['additional_fee'] = 0.0
 
     return dataset_calling_table, access_fees, 0
 
 
-def map_access_fees(dataset: pd.DataFrame, access_fee_mapping: Dict[str, float]) -> pd.DataFrame:
-    dataset['fee'] = dataset['data_category'].apply(lambda x: access_fee_mapping[x])
-    dataset['fee'] = dataset['id'] * dataset['fee']
-    dataset['timestamp'] = dataset['timestamp'].apply(
-        lambda x: x.replace(day=1)).astype(str)
-    return dataset.groupby(by=["data_category", "timestamp"])['fee'].sum().reset_index()
-
-
-def compare_and_concat_access_fees(current_access_fee_table: pd.DataFrame, new_records: pd.DataFrame) -> pd.DataFrame:
-    access_fee_table = pd.merge(current_access_fee_table, new_records, how='outer',
-                                left_on=['data_category', 'timestamp'],
-                                right_on=['data_category', 'timestamp'])
-
-    access_fee_table = access_fee_table.fillna(0)
-
-    def track_difference_and_create_concat_string(row) -> str:
-        if row['fee_y'] != 0:
-            return f"${row['fee_x']:,.2f} + ${row['fee_y']:,.2f}"
-        else:
-            return f"${row['fee_x']:,.2f}"
+@profiled("access.mapping")
+def map_access_fees(dataset: pd.DataFrame, fee_schedules: List[FeeSchedule]) -> pd.DataFrame:
+    # sum the integer access counts by category and month first, then price each group once at the rate in effect
+    # that month, so the rate lookup and the float multiply happen per group rather than per row
+    accesses = pd.DataFrame({'data_category': dataset['data_category'].astype('category'),
+                             'timestamp': pd.to_datetime(dataset['timestamp']).to_numpy().astype('datetime64[M]'),
+                             'id': dataset['id'].to_numpy()})
+    fees = accesses.groupby(by=["data_category", "timestamp"], observed=True)['id'].sum().reset_index()
 
-    access_fee_table['fee'] = access_fee_table.apply(track_difference_and_create_concat_string, axis=1)
+    # only the handful of category months left get turned back into the labels the pivots use
+    fees['data_category'] = fees['data_category'].astype(str)
+    fees['fee'] = fees['id'] * lookup_access_rates_by_month(fees['data_category'], fees['timestamp'], fee_schedules)
+    fees['timestamp'] = fees['timestamp'].dt.strftime("%Y-%m-%d")
+    return fees[['data_category', 'timestamp', 'fee']]
 
-    return access_fee_table[['data_category', 'timestamp', 'fee']].copy()
 
-
-def return_access_fees(fee_modifier: Union[List[dict], None] = None) -> (pd.DataFrame, float, float):
-    # not really subject to change so can be hard coded dict
-    access_mapping = {"Pricing": 0.01, "Security Master": 0.01, "Snapshot Pricing": 0.03, "Derived": 0.03}
-    data, requests = dataset_connector()
-    data = calculate_number_of_new_accesses_per_day(data, requests)
-
-    data, current_fees, additional_fees = transient_branching_function_map_new_rows_to_old(data, access_mapping, fee_modifier)
+def compare_and_concat_access_fees(current_access_fee_table: pd.DataFrame, new_records: pd.DataFrame) -> pd.DataFrame:
+    access_fee_table = pd.merge(current_access_fee_table, new_records.rename(columns={'fee': 'additional_fee'}),
+                                how='outer', on=['data_category', 'timestamp'])
+
+    return access_fee_table[['data_category', 'timestamp', 'fee', 'additional_fee']].fillna(0)
+
+
+def open_date_ranges(closed: pd.DatetimeIndex) -> List[tuple]:
+    # the stretches of time between closed months, open ended before the first and after the last
+    ranges, date_from = [], None
+    for month in closed.sort_values():
+        if date_from is None or month > date_from:
+            ranges.append((None if date_from is None else date_from.date(), month.date()))
+        date_from = month + pd.offsets.MonthBegin(1)
+    ranges.append((None if date_from is None else date_from.date(), None))
+    return ranges
+
+
+def build_daily_accesses(base_data: Union[BaseData, None] = None, aggregation_mode: str = access_aggregation_mode,
+                         engine: Union[sql.engine.Engine, None] = None,
+                         billing_history: Union[pd.DataFrame, None] = None) -> pd.DataFrame:
+    # access fees count every request, successful or not. closed months are billed already and never counted again,
+    # their requests are dropped before the distinct count rather than after it
+    if billing_history is None:
+        billing_history = read_billing_history()
+    closed = closed_months(billing_history, "access")
+
+    if aggregation_mode == "pushdown":
+        # one range scan per stretch between closed months, usually just the one since the last close
+        return pd.concat([query_number_of_new_accesses_per_day(engine, date_from, date_to)
+                          for date_from, date_to in open_date_ranges(closed)], ignore_index=True)
+    elif aggregation_mode == "memory":
+        if base_data is None:
+            base_data = load_base_data(engine)
+        requests = base_data.requests[['timestamp', 'dataset_id']]
+        if len(closed):
+            requests = requests.loc[~pd.DatetimeIndex(requests['timestamp'].to_numpy().astype('datetime64[M]'))
+                                    .isin(closed)]
+        return calculate_number_of_new_accesses_per_day(base_data.datasets, requests)
+
+    raise ValueError(f"aggregation_mode must be 'memory' or 'pushdown', got {aggregation_mode!r}")
+
+
+@profiled("access.total")
+def return_access_fees(fee_modifier: Union[List[dict], None] = None,
+                       base_data: Union[BaseData, None] = None,
+                       aggregation_mode: str = access_aggregation_mode,
+                       engine: Union[sql.engine.Engine, None] = None,
+                       daily_accesses: Union[pd.DataFrame, None] = None,
+                       billing_history: Union[pd.DataFrame, None] = None) -> (pd.DataFrame, float, float, pd.DataFrame):
+    fee_schedules = load_fee_schedules()
+
+    # callers pricing an earlier period pass the history as it stood then
+    if billing_history is None:
+        billing_history = read_billing_history()
+    if daily_accesses is None:
+        daily_accesses = build_daily_accesses(base_data, aggregation_mode, engine, billing_history)
+
+    # closed months are billed already, only the open ones are priced from the requests. the mapping steps below
+    # modify the frame in place, so this also keeps them off a cached one
+    frozen = pd.DatetimeIndex(daily_accesses['timestamp'].to_numpy().astype('datetime64[M]')).isin(
+        closed_months(billing_history, "access"))
+    data = daily_accesses.loc[~frozen].copy()
+
+    data, current_fees, additional_fees = transient_branching_function_map_new_rows_to_old(data, fee_schedules, fee_modifier)
     # streamlit is being really weird and return a date as a datetime
 
-    # add december data
-    december_sum = 581.51 + 279.30 + 155.32 + 606.92
-    current_fees = december_sum + current_fees
-    data = pd.concat([create_december_data(), data])
-    data = pivot_table(data).fillna("$0.00")
-
-    if additional_fees:
-        return data, current_fees, additional_fees
-    return data, current_fees, 0
-
-
-def create_december_data() -> pd.DataFrame:
-    december_data = [{"data_category": "Security Master", "timestamp": "2022-12-01", "fee": "$581.52"},
-                     {"data_category": "Derived", "timestamp": "2022-12-01", "fee": "$279.30"},
-                     {"data_category": "Pricing", "timestamp": "2022-12-01", "fee": "$155.32"},
-                     {"data_category": "Historical", "timestamp": "2022-12-01", "fee": "$606.92"}]
+    closed_fees = closed_access_fees(billing_history)
+    current_fees = closed_fees['fee'].sum() + current_fees
+    data = pd.concat([closed_fees, data]).fillna(0)
 
-    return pd.DataFrame(december_data)
+    return pivot_table(data), current_fees, additional_fees, pivot_table(data, values='additional_fee')
 
 
-def pivot_table(table: pd.DataFrame):
-    return pd.pivot_table(table, values="fee", index="data_category", columns='timestamp', aggfunc=lambda x: ''.join(x))
+def pivot_table(table: pd.DataFrame, values: str = "fee"):
+    return pd.pivot_table(table, values=values, index="data_category", columns='timestamp', aggfunc='sum',
+                          fill_value=0)
 
@@ -0,0 +1,252 @@
+from access_fees import calculate_number_of_new_accesses_per_day, query_number_of_new_accesses_per_day, \
+    create_recommended_indexes, return_access_fees
+from unique_fees import squash_dataset_table_and_merge_with_request_table, \
+    calculate_rolling_cumulative_securities_by_month, map_reference_fee_table_to_security_counter_table, \
+    apply_category_additions, compare_fee_changes, pivot_table_fee, pivot_table_sec_number, calculate_band_headroom
+from requests_plot import count_requests_by_day, request_chart
+from fee_schedule import load_fee_schedules
+from data_loader import BaseData, load_base_data, successful_requests
+from request_snapshot import clear_snapshot
+from typing import Any, Callable, Dict, List, Union
+import sqlalchemy as sql
+import pandas as pd
+import numpy as np
+import tracemalloc
+import argparse
+import datetime
+import platform
+import tempfile
+import sqlite3
+import shutil
+import json
+import time
+import sys
+import os
+
+DATA_CATEGORIES = ["Derived", "Pricing", "Security Master"]
+
+
+def generate_synthetic_database(path: str, number_of_requests: int, number_of_securities: int,
+                                number_of_datasets: int = 500, number_of_universes: int = 200,
+                                number_of_days: int = 180, seed: int = 0) -> sql.engine.Engine:
+    rng = np.random.default_rng(seed)
+    if os.path.exists(path):
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE field_lists (id INTEGER PRIMARY KEY, data_category TEXT);
+        CREATE TABLE universes (id INTEGER, security TEXT);
+        CREATE TABLE datasets (id INTEGER PRIMARY KEY, name TEXT, universeid INTEGER, field_listid INTEGER);
+        CREATE TABLE requests (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME, dataset_id INTEGER,
+                               success INTEGER);
+    """)
+    conn.executemany("INSERT INTO field_lists VALUES (?, ?)",
+                     [(i + 1, data_category) for i, data_category in enumerate(DATA_CATEGORIES)])
+
+    # universes hold a random slice of the security master, sized so most securities appear somewhere
+    universe_size = max(1, min(number_of_securities, 3 * number_of_securities // number_of_universes))
+    conn.executemany("INSERT INTO universes VALUES (?, ?)",
+                     ((universe_id, f"SEC{security:06d} Equity")
+                      for universe_id in range(1, number_of_universes + 1)
+                      for security in rng.choice(number_of_securities, universe_size, replace=False)))
+
+    conn.executemany("INSERT INTO datasets VALUES (?, ?, ?, ?)",
+                     ((dataset_id, f"{'bidask' if dataset_id % 5 == 0 else 'dataset'}_{dataset_id:05d}",
+                       int(rng.integers(1, number_of_universes + 1)), int(rng.integers(1, len(DATA_CATEGORIES) + 1)))
+                      for dataset_id in range(1, number_of_datasets + 1)))
+
+    # insert requests in time order in chunks so tens of millions of rows never sit in memory at once
+    start = np.datetime64('2023-01-01T00:00:00')
+    chunk_size = 1_000_000
+    offsets = np.sort(rng.integers(0, number_of_days * 86400, number_of_requests))
+    for chunk_start in range(0, number_of_requests, chunk_size):
+        chunk = offsets[chunk_start:chunk_start + chunk_size]
+        timestamps = np.datetime_as_string(start + chunk.astype('timedelta64[s]'), unit='s')
+        conn.executemany("INSERT INTO requests (timestamp, dataset_id, success) VALUES (?, ?, ?)",
+                         zip(np.char.replace(timestamps, 'T', ' ').tolist(),
+                             rng.integers(1, number_of_datasets + 1, len(chunk)).tolist(),
+                             (rng.random(len(chunk)) < 0.95).astype(int).tolist()))
+
+    conn.commit()
+    conn.close()
+
+    return sql.create_engine(f"sqlite:///{path}")
+
+
+def time_call(function: Callable, repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+
+    return {"best_seconds": min(timings), "mean_seconds": sum(timings) / len(timings), "rows_out": len(result)}
+
+
+def benchmark_access_aggregation(engine: sql.engine.Engine, repeats: int = 3) -> dict:
+    def in_memory():
+        base_data = load_base_data(engine, snapshot_directory="", streaming=False)
+        return calculate_number_of_new_accesses_per_day(base_data.datasets, base_data.requests)
+
+    create_recommended_indexes(engine)
+
+    results = {"memory": time_call(in_memory, repeats),
+               "pushdown": time_call(lambda: query_number_of_new_accesses_per_day(engine), repeats)}
+    results["winner"] = min(("memory", "pushdown"), key=lambda mode: results[mode]["best_seconds"])
+
+    return results
+
+
+def measure(results: List[dict], stage: str, function: Callable, *args,
+            prepare: Union[Callable[[], None], None] = None) -> Any:
+    # wall time and python/numpy peak allocation of one stage. tracemalloc slows allocation heavy stages down a lot,
+    # so the stage runs twice, timed untraced and then traced for its peak. prepare puts back any state the stage
+    # changes before each run
+    if prepare is not None:
+        prepare()
+    started = time.perf_counter()
+    value = function(*args)
+    wall_seconds = time.perf_counter() - started
+
+    if prepare is not None:
+        prepare()
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    results.append({"stage": stage, "wall_seconds": wall_seconds, "peak_memory_mb": peak / 2 ** 20,
+                    "rows_out": len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None,
+                    "frame_memory_mb": frame_memory_mb(value)})
+    return value
+
+
+def frame_memory_mb(value: Any) -> Union[float, None]:
+    # what the stage's output frames hold on to afterwards, strings counted in full
+    frames = [value] if isinstance(value, (pd.DataFrame, pd.Series)) else \
+        [item for item in value if isinstance(item, (pd.DataFrame, pd.Series))] if isinstance(value, tuple) else []
+    if not frames:
+        return None
+    return float(sum(frame.memory_usage(deep=True).sum() if isinstance(frame, pd.DataFrame) else
+                     frame.memory_usage(deep=True) for frame in frames)) / 2 ** 20
+
+
+def base_data_memory_mb(base_data: BaseData) -> Dict[str, float]:
+    # in memory size of each loaded frame, strings included, so the effect of the compact types shows up
+    return {name: frame.memory_usage(deep=True).sum() / 2 ** 20 for name, frame in base_data._asdict().items()}
+
+
+def benchmark_pipelines(engine: sql.engine.Engine) -> List[dict]:
+    results = []
+    fee_modifier = [{"Data Category": "Pricing", "Number of Securities": 100, "Frequency per Day": 2}]
+    category_additions = {"Derived": 0, "Pricing": 100, "Security Master": 0}
+
+    # load, a full read and a cold then warm parquet snapshot
+    snapshot_directory = tempfile.mkdtemp(prefix="benchmark_snapshot_")
+    try:
+        base_data = measure(results, "load.full", load_base_data, engine, "", False)
+        results[-1]["frame_memory_mb"] = base_data_memory_mb(base_data)
+        streamed = measure(results, "load.streamed", load_base_data, engine, "", True)
+        results[-1]["frame_memory_mb"] = base_data_memory_mb(streamed)
+        measure(results, "load.snapshot_cold", load_base_data, engine, snapshot_directory, False,
+                prepare=lambda: clear_snapshot(snapshot_directory))
+        measure(results, "load.snapshot_warm", load_base_data, engine, snapshot_directory, False)
+    finally:
+        shutil.rmtree(snapshot_directory, ignore_errors=True)
+
+    # unique fees
+    requests = successful_requests(base_data)
+    merged = measure(results, "unique.merge", squash_dataset_table_and_merge_with_request_table, base_data.datasets,
+                     requests)
+    security_counter = measure(results, "unique.rolling_count", calculate_rolling_cumulative_securities_by_month,
+                               merged)
+
+    def band_mapping():
+        fee_schedules = load_fee_schedules()
+        fee_table = map_reference_fee_table_to_security_counter_table(security_counter.copy(), fee_schedules,
+                                                                      dict.fromkeys(category_additions, 0), "cap")
+        return fee_table, apply_category_additions(fee_table, fee_schedules, category_additions, "cap")
+
+    fee_table, additional_fee_table = measure(results, "unique.band_mapping", band_mapping)
+
+    def unique_pivot():
+        compared = compare_fee_changes(fee_table, additional_fee_table)[0]
+        return pivot_table_fee(compared), pivot_table_sec_number(compared)
+
+    measure(results, "unique.pivot", unique_pivot)
+    measure(results, "unique.band_headroom", calculate_band_headroom, security_counter, load_fee_schedules())
+
+    # access fees
+    daily_accesses = measure(results, "access.merge", calculate_number_of_new_accesses_per_day, base_data.datasets,
+                             base_data.requests)
+    measure(results, "access.pivot", lambda: return_access_fees(fee_modifier, daily_accesses=daily_accesses)[0])
+
+    # request chart
+    request_counts = measure(results, "chart.aggregate", count_requests_by_day, base_data)
+    measure(results, "chart.figure", request_chart, None, request_counts)
+
+    return results
+
+
+def compare_results(previous: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    # stages that got slower or hungrier than the previous run by more than the tolerance
+    previous_stages = {result["stage"]: result for result in previous["stages"]}
+    regressions = []
+    for result in current["stages"]:
+        if (before := previous_stages.get(result["stage"])) is None:
+            continue
+        for metric in ("wall_seconds", "peak_memory_mb"):
+            if before[metric] and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{result['stage']} {metric}: {before[metric]:.3f} -> {result[metric]:.3f}")
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the fee engines against a synthetic sqlite database")
+    parser.add_argument("--database", default="benchmark.db")
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--securities", type=int, default=5_000)
+    parser.add_argument("--datasets", type=int, default=500)
+    parser.add_argument("--universes", type=int, default=200)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reuse-database", action="store_true", help="benchmark an existing database as is")
+    parser.add_argument("--compare-access-modes", action="store_true",
+                        help="also time in-memory against pushdown access aggregation")
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--baseline", help="previous results json to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging, 0.2 = 20%%")
+    arguments = parser.parse_args()
+
+    if arguments.reuse_database and os.path.exists(arguments.database):
+        benchmark_engine = sql.create_engine(f"sqlite:///{arguments.database}")
+    else:
+        benchmark_engine = generate_synthetic_database(arguments.database, arguments.requests, arguments.securities,
+                                                       arguments.datasets, arguments.universes, arguments.days,
+                                                       arguments.seed)
+
+    benchmark_results = {"run_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                         "python": platform.python_version(), "pandas": pd.__version__,
+                         "parameters": {key: value for key, value in vars(arguments).items()
+                                        if key in ("requests", "securities", "datasets", "universes", "days",
+                                                   "seed")},
+                         "stages": benchmark_pipelines(benchmark_engine)}
+    if arguments.compare_access_modes:
+        benchmark_results["access_aggregation"] = benchmark_access_aggregation(benchmark_engine, arguments.repeats)
+
+    print(json.dumps(benchmark_results, indent=2))
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(benchmark_results, f, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as f:
+            found_regressions = compare_results(json.load(f), benchmark_results, arguments.tolerance)
+        for regression in found_regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        sys.exit(1 if found_regressions else 0)
@@ -0,0 +1,69 @@
+from typing import Union
+import pandas as pd
+import datetime
+import os
+
+# invoiced figures for months that are closed, the engine takes these as they are and never recomputes them
+BILLING_HISTORY_PATH = "billing_history.csv"
+# securities carried over from before the request history starts, counted towards the unique fee bands while valid
+OPENING_BALANCES_PATH = "opening_balances.csv"
+
+BILLING_HISTORY_COLUMNS = ["Fee Type", "Data Category", "Month", "Number of Securities", "Fee"]
+FEE_TYPES = ("unique", "access")
+
+
+def read_billing_history(path: str = BILLING_HISTORY_PATH) -> pd.DataFrame:
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=BILLING_HISTORY_COLUMNS).astype({"Month": "datetime64[ns]", "Fee": float})
+
+    history = pd.read_csv(path, parse_dates=["Month"])
+    if not history["Fee Type"].isin(FEE_TYPES).all():
+        raise ValueError(f"Billing history fee types must be one of {FEE_TYPES}, got "
+                         f"{history.loc[~history['Fee Type'].isin(FEE_TYPES), 'Fee Type'].iloc[0]!r}")
+    if history.duplicated(subset=["Fee Type", "Data Category", "Month"]).any():
+        raise ValueError("Billing history has more than one row for the same fee type, data category and month")
+
+    return history
+
+
+def write_billing_history(history: pd.DataFrame, path: str = BILLING_HISTORY_PATH):
+    history = history.sort_values(by=["Month", "Fee Type", "Data Category"], kind="stable")
+    history = history[BILLING_HISTORY_COLUMNS].astype({"Number of Securities": "Int64"})
+    history.to_csv(path + ".tmp", index=False, date_format="%Y-%m-%d")
+    os.replace(path + ".tmp", path)
+
+
+def closed_unique_fees(history: pd.DataFrame) -> pd.DataFrame:
+    # shaped like a priced security counter so it can sit on top of one
+    unique = history.loc[history["Fee Type"] == "unique"]
+    return pd.DataFrame({"data_category": unique["Data Category"].to_numpy(),
+                         "timestamp": unique["Month"].dt.date.to_numpy(),
+                         "number_of_cumulative_securities": unique["Number of Securities"].to_numpy(dtype="int64"),
+                         "unique_fee": unique["Fee"].to_numpy(dtype=float)})
+
+
+def closed_access_fees(history: pd.DataFrame) -> pd.DataFrame:
+    # shaped like a mapped access fee table, months as the labels the pivots use
+    access = history.loc[history["Fee Type"] == "access"]
+    return pd.DataFrame({"data_category": access["Data Category"].to_numpy(),
+                         "timestamp": access["Month"].dt.strftime("%Y-%m-%d").to_numpy(),
+                         "fee": access["Fee"].to_numpy(dtype=float)})
+
+
+def closed_months(history: pd.DataFrame, fee_type: str) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(history.loc[history["Fee Type"] == fee_type, "Month"].unique())
+
+
+def read_opening_balances(path: str = OPENING_BALANCES_PATH) -> pd.DataFrame:
+    # an empty valid from or valid until leaves that end of the range open
+    if not os.path.exists(path):
+        return pd.DataFrame({"Data Category": pd.Series(dtype=object), "Number of Securities": pd.Series(dtype=int),
+                             "Valid From": pd.Series(dtype="datetime64[ns]"),
+                             "Valid Until": pd.Series(dtype="datetime64[ns]")})
+
+    return pd.read_csv(path, parse_dates=["Valid From", "Valid Until"])
+
+
+def first_open_month(today: Union[datetime.date, None] = None) -> datetime.date:
+    # the current calendar month is still accruing and can't be closed
+    return (today or datetime.date.today()).replace(day=1)
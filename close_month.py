@@ -0,0 +1,62 @@
+from billing_history import read_billing_history, write_billing_history, closed_months, first_open_month, \
+    BILLING_HISTORY_PATH
+from unique_fees import build_security_counter, map_reference_fee_table_to_security_counter_table
+from access_fees import build_daily_accesses, map_access_fees
+from fee_schedule import load_fee_schedules
+from data_loader import BaseData, load_base_data
+from typing import Union
+import pandas as pd
+import argparse
+import datetime
+
+
+def close_month(month: datetime.date, base_data: Union[BaseData, None] = None,
+                history_path: str = BILLING_HISTORY_PATH) -> pd.DataFrame:
+    # freeze one finished month's unique and access fees into the billing history, after this the dashboard shows
+    # the stored figures for it whatever the requests table says
+    month = month.replace(day=1)
+    if month >= first_open_month():
+        raise ValueError(f"{month:%Y-%m} hasn't finished yet and can't be closed")
+
+    billing_history = read_billing_history(history_path)
+    if pd.Timestamp(month) in closed_months(billing_history, "unique").union(
+            closed_months(billing_history, "access")):
+        raise ValueError(f"{month:%Y-%m} is already closed, edit {history_path} to correct it")
+
+    if base_data is None:
+        base_data = load_base_data()
+
+    fee_schedules = load_fee_schedules()
+    unique_fees = map_reference_fee_table_to_security_counter_table(build_security_counter(base_data, billing_history),
+                                                                    fee_schedules, {})
+    unique_fees = unique_fees.loc[unique_fees['timestamp'] == month]
+
+    daily_accesses = build_daily_accesses(base_data, billing_history=billing_history)
+    access_fees = map_access_fees(daily_accesses.loc[daily_accesses['timestamp'].dt.to_period('M') ==
+                                                     pd.Period(month, freq='M')].copy(), fee_schedules)
+
+    if unique_fees.empty and access_fees.empty:
+        raise ValueError(f"No requests in {month:%Y-%m} to close")
+
+    closed = pd.concat([pd.DataFrame({"Fee Type": "unique", "Data Category": unique_fees['data_category'],
+                                      "Month": pd.Timestamp(month),
+                                      "Number of Securities": unique_fees['number_of_cumulative_securities'],
+                                      "Fee": unique_fees['unique_fee']}),
+                        pd.DataFrame({"Fee Type": "access", "Data Category": access_fees['data_category'],
+                                      "Month": pd.Timestamp(month), "Fee": access_fees['fee']})], ignore_index=True)
+    write_billing_history(pd.concat([billing_history, closed], ignore_index=True), history_path)
+
+    return closed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeze a finished month's fees into the billing history")
+    parser.add_argument("month", type=lambda value: datetime.datetime.strptime(value, "%Y-%m").date(),
+                        help="month to close as YYYY-MM")
+    parser.add_argument("--history", default=BILLING_HISTORY_PATH)
+    arguments = parser.parse_args()
+
+    try:
+        print(close_month(arguments.month, history_path=arguments.history).to_string(index=False))
+    except ValueError as error:
+        parser.error(str(error))
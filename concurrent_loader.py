@@ -0,0 +1,34 @@
+from creds import loader_max_workers
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, Tuple
+import contextvars
+import threading
+
+
+def run_once(loader: Callable[[], Any]) -> Callable[[], Any]:
+    # several tasks can need the same input, the first to ask loads it and the rest wait for that result
+    lock = threading.Lock()
+    loaded = []
+
+    def shared() -> Any:
+        with lock:
+            if not loaded:
+                loaded.append(loader())
+        return loaded[0]
+
+    return shared
+
+
+def load_concurrently(tasks: Dict[str, Callable[[], Any]],
+                      max_workers: int = loader_max_workers) -> Iterator[Tuple[str, Any]]:
+    # yields (name, result) in the order tasks finish, the first failure is raised to the caller and any task that
+    # hasn't started yet is cancelled, the pool only shuts down once the running ones are done. tasks run in a copy of
+    # the caller's context, so what they profile lands in the caller's run
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="loader") as executor:
+        futures = {executor.submit(contextvars.copy_context().run, task): name for name, task in tasks.items()}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
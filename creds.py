@@ -2,6 +2,35 @@ import os
 
 db_connection_string = os.getenv("db_connection_string")
 
+# local parquet copy of the requests table, set to an empty string to always read the full table from the database
+request_snapshot_directory = os.getenv("request_snapshot_directory", "request_snapshot")
+# ids below the high water mark read again on every refresh, so rows committed late under a lower id still land
+request_snapshot_id_overlap = int(os.getenv("request_snapshot_id_overlap", "10000"))
 
+# "memory" aggregates daily accesses in pandas, "pushdown" runs the grouped count in the database
+access_aggregation_mode = os.getenv("access_aggregation_mode", "memory")
 
+# seconds a cached security counter or daily access table is reused before being rebuilt
+fee_cache_ttl_seconds = int(os.getenv("fee_cache_ttl_seconds", "900"))
 
+# per stage timings, off unless asked for, the log path gets one json line per stage when set
+profiling_enabled = os.getenv("profiling_enabled", "false").lower() in ("1", "true", "yes")
+profiling_log_path = os.getenv("profiling_log_path")
+
+# summary tables the dashboard reads instead of raw requests, set to an empty string to compute from raw rows
+request_summary_directory = os.getenv("request_summary_directory", "request_summaries")
+# "thread" refreshes the summaries inside the app, "external" leaves them and the snapshot to
+# `python request_summaries.py` and the app only reads them
+summary_refresher_mode = os.getenv("summary_refresher_mode", "thread")
+summary_refresh_interval_seconds = int(os.getenv("summary_refresh_interval_seconds", "300"))
+
+# independent page sections load on this many threads, the database pool is sized to match
+loader_max_workers = int(os.getenv("loader_max_workers", "4"))
+
+# fold the raw requests into per day counts a chunk at a time instead of holding every row, for request tables that
+# outgrow the container's memory. the chunk size also bounds every streamed read from the requests table
+request_streaming = os.getenv("request_streaming", "false").lower() in ("1", "true", "yes")
+request_chunk_size = int(os.getenv("request_chunk_size", "250000"))
+
+# band alerts flag a category whose count is projected to cross into its next unique fee band within this many days
+band_alert_horizon_days = int(os.getenv("band_alert_horizon_days", "90"))
@@ -0,0 +1,123 @@
+from creds import db_connection_string, request_snapshot_directory, loader_max_workers, request_streaming, \
+    request_chunk_size
+from request_snapshot import refresh_snapshot, read_snapshot, read_high_water_mark, iterate_snapshot
+from typing import Iterable, Iterator, NamedTuple, Union
+from sqlalchemy import text
+from profiling import profiled
+import sqlalchemy as sql
+import pandas as pd
+
+REQUESTS_QUERY = "SELECT id, timestamp, dataset_id, success FROM requests"
+DATASETS_QUERY = ("SELECT d.id as id, u.security as security, fl.data_category as data_category from datasets d "
+                  "JOIN field_lists fl ON d.field_listid=fl.id JOIN universes u ON u.id=d.universeid")
+DATASET_NAMES_QUERY = "SELECT id, name FROM datasets"
+
+_engine = None
+
+
+class BaseData(NamedTuple):
+    requests: pd.DataFrame
+    datasets: pd.DataFrame
+    dataset_names: pd.DataFrame
+
+
+def get_engine() -> sql.engine.Engine:
+    # one pooled engine per process, streamlit reruns the script but keeps imported modules. the pool holds a
+    # connection per loader thread plus a little overflow for the summary refresher
+    global _engine
+    if _engine is None:
+        _engine = sql.create_engine(db_connection_string, pool_pre_ping=True, pool_recycle=3600,
+                                    pool_size=loader_max_workers, max_overflow=2)
+    return _engine
+
+
+@profiled("load.base_data")
+def load_base_data(engine: Union[sql.engine.Engine, None] = None,
+                   snapshot_directory: Union[str, None] = request_snapshot_directory,
+                   streaming: bool = request_streaming) -> BaseData:
+    engine = engine if engine is not None else get_engine()
+
+    # with a snapshot only the rows past the high water mark cross the wire, streaming folds the requests into per
+    # day counts as they are read instead of keeping every row
+    if snapshot_directory:
+        refresh_snapshot(engine, snapshot_directory)
+        requests = fold_request_days(iterate_snapshot(snapshot_directory)) if streaming else \
+            read_snapshot(snapshot_directory)
+    elif streaming:
+        requests = fold_request_days(stream_requests(engine))
+    else:
+        with engine.connect() as conn:
+            # parse_dates keeps sqlite stand-ins (which return strings) in line with mysql datetimes
+            requests = pd.read_sql(text(REQUESTS_QUERY), conn, parse_dates=['timestamp'])
+
+    datasets, dataset_names = load_dataset_tables(engine)
+    return BaseData(requests=compact_requests(requests), datasets=compact_datasets(datasets),
+                    dataset_names=compact_dataset_names(dataset_names))
+
+
+def load_dataset_tables(engine: Union[sql.engine.Engine, None] = None) -> (pd.DataFrame, pd.DataFrame):
+    # the dataset side of the joins, small next to requests and always read straight from the database
+    engine = engine if engine is not None else get_engine()
+
+    with engine.connect() as conn:
+        datasets = pd.read_sql(text(DATASETS_QUERY), conn)
+        dataset_names = pd.read_sql(text(DATASET_NAMES_QUERY), conn)
+
+    return datasets, dataset_names
+
+
+def stream_requests(engine: sql.engine.Engine, chunk_size: int = request_chunk_size) -> Iterator[pd.DataFrame]:
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql(text(REQUESTS_QUERY), conn, parse_dates=['timestamp'], chunksize=chunk_size)
+
+
+@profiled("load.fold_request_days")
+def fold_request_days(chunks: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    # one row per day, dataset and success flag with the number of requests behind it. every pipeline only needs
+    # requests at day grain, so this holds as many rows as there are active dataset days however long the history
+    request_days = None
+    for chunk in chunks:
+        counts = chunk.groupby([chunk['timestamp'].dt.normalize(), chunk['dataset_id'].astype('int32'),
+                                chunk['success'].astype('int8')]).size()
+        request_days = counts if request_days is None else request_days.add(counts, fill_value=0)
+
+    if request_days is None:
+        return pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[ns]'), 'dataset_id': pd.Series(dtype='int32'),
+                             'success': pd.Series(dtype='int8'), 'requests': pd.Series(dtype='int64')})
+    return request_days.astype('int64').rename('requests').reset_index()
+
+
+def compact_requests(requests: pd.DataFrame) -> pd.DataFrame:
+    # int32 dataset ids halve the join keys every pipeline merges on
+    return requests.astype({'dataset_id': 'int32', 'success': 'int8'})
+
+
+def compact_datasets(datasets: pd.DataFrame) -> pd.DataFrame:
+    # tickers and categories repeat across every universe they sit in, so carry them as dictionary codes and let the
+    # merges and groupbys downstream work on the codes instead of python strings
+    return datasets.astype({'id': 'int32', 'security': 'category', 'data_category': 'category'})
+
+
+def compact_dataset_names(dataset_names: pd.DataFrame) -> pd.DataFrame:
+    return dataset_names.astype({'id': 'int32'})
+
+
+def data_version(engine: Union[sql.engine.Engine, None] = None,
+                 snapshot_directory: Union[str, None] = request_snapshot_directory) -> int:
+    # the newest request id, anything computed from the requests table is stale once this moves
+    engine = engine if engine is not None else get_engine()
+
+    if snapshot_directory:
+        refresh_snapshot(engine, snapshot_directory)
+        return read_high_water_mark(snapshot_directory)["id"]
+
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM requests")).scalar()
+
+
+def successful_requests(base_data: BaseData) -> pd.DataFrame:
+    # folded requests keep the count of raw requests each row stands for
+    requests = base_data.requests
+    columns = ['timestamp', 'dataset_id'] + (['requests'] if 'requests' in requests else [])
+    return requests.loc[requests['success'] == 1, columns].reset_index(drop=True)
@@ -1,30 +1,69 @@
-from creds import db_connection_string
+from data_loader import get_engine
+from typing import Iterable, Union
 from sqlalchemy import text
+from profiling import profiled
 import sqlalchemy as sql
 import pandas as pd
+import numpy as np
 
+# datasets are grouped by the start of their name, the way the breakdown query's SUBSTRING(d.name, 1, 6) does
+NAME_PREFIX_LENGTH = 6
 
-def connect_to_dataset() -> pd.DataFrame:
-    engine = sql.create_engine(db_connection_string)
 
-    with engine.connect() as conn:
-        datasets = pd.read_sql(text("""SELECT 
-  CASE WHEN SUBSTRING(d.name, 1, 6) = 'bidask' then 'bidask' else d.name end AS `Dataset name`, 
-  GROUP_CONCAT(DISTINCT data_category SEPARATOR ', ') as `Data Categories`, 
+# the reference the in memory breakdown is checked against, kept to sql mysql and sqlite both run. group_concat
+# separators and order differ between them, so the categories are tidied up afterwards
+DATASET_BREAKDOWN_QUERY = """SELECT
+  CASE WHEN SUBSTR(d.name, 1, 6) = 'bidask' THEN 'bidask' ELSE MIN(d.name) END AS `Dataset name`,
+  GROUP_CONCAT(DISTINCT fl.data_category) AS `Data Categories`,
   COUNT(DISTINCT u.security) AS `Number of Securities`,
-	COUNT(DISTINCT d.name) as `Number of Daily Calls`
-FROM 
-  datasets d 
-  JOIN universes u ON d.universeid = u.id 
-  JOIN field_lists fl ON d.field_listid = fl.id 
-	JOIN requests r ON r.dataset_id = d.id
-GROUP BY 
-  SUBSTRING(d.name, 1, 6)
+  COUNT(DISTINCT d.name) AS `Number of Daily Calls`
+FROM
+  datasets d
+  JOIN universes u ON d.universeid = u.id
+  JOIN field_lists fl ON d.field_listid = fl.id
+  JOIN (SELECT DISTINCT dataset_id FROM requests) r ON r.dataset_id = d.id
+GROUP BY
+  SUBSTR(d.name, 1, 6)
+"""
+
 
-"""), conn)
+@profiled("breakdown.query")
+def connect_to_dataset(engine: Union[sql.engine.Engine, None] = None) -> pd.DataFrame:
+    engine = engine if engine is not None else get_engine()
 
-        engine.dispose()
+    with engine.connect() as conn:
+        datasets = pd.read_sql(text(DATASET_BREAKDOWN_QUERY), conn)
 
+    datasets['Data Categories'] = datasets['Data Categories'].map(
+        lambda categories: ', '.join(sorted(category.strip() for category in categories.split(','))))
     datasets = datasets.set_index('Dataset name')
 
     return datasets
+
+
+def requested_datasets_by_month(requests: pd.DataFrame) -> pd.DataFrame:
+    # which datasets were called at all in each month, successful or not
+    return pd.DataFrame({'timestamp': requests['timestamp'].to_numpy().astype('datetime64[M]'),
+                         'dataset_id': requests['dataset_id'].to_numpy()}).drop_duplicates().reset_index(drop=True)
+
+
+@profiled("breakdown.frames")
+def compute_dataset_breakdown(datasets: pd.DataFrame, dataset_names: pd.DataFrame,
+                              requested_dataset_ids: Iterable[int]) -> pd.DataFrame:
+    # the breakdown query from frames already in memory: requests only decide which datasets count, so they are
+    # reduced to the distinct ids before anything is joined
+    dataset_names = dataset_names.loc[dataset_names['id'].isin(pd.unique(np.asarray(requested_dataset_ids)))]
+    dataset_names = dataset_names.assign(name_prefix=dataset_names['name'].str[:NAME_PREFIX_LENGTH])
+    securities = pd.merge(datasets[['id', 'security', 'data_category']], dataset_names, how='inner', on='id')
+
+    # every bidask dataset shares one row, any other prefix is named after its first dataset
+    groups = securities.groupby('name_prefix', observed=True)
+    breakdown = pd.DataFrame({
+        'Dataset name': groups['name'].min(),
+        'Data Categories': securities[['name_prefix', 'data_category']].drop_duplicates().astype(str).sort_values(
+            by=['name_prefix', 'data_category']).groupby('name_prefix')['data_category'].agg(', '.join),
+        'Number of Securities': groups['security'].nunique(),
+        'Number of Daily Calls': groups['name'].nunique()})
+    breakdown['Dataset name'] = breakdown['Dataset name'].where(breakdown.index != 'bidask', 'bidask')
+
+    return breakdown.set_index('Dataset name')
@@ -0,0 +1,57 @@
+from creds import fee_cache_ttl_seconds
+from typing import Any, Callable, Hashable, Union
+import pandas as pd
+import threading
+import hashlib
+import time
+import os
+
+# one entry per cached result, shared by every streamlit session served by this process
+_entries = {}
+_statistics = {}
+_lock = threading.Lock()
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def optional_file_hash(path: str) -> Union[str, None]:
+    # for reference files whose readers take a missing file as an empty one
+    return file_hash(path) if os.path.exists(path) else None
+
+
+def get_or_build(name: str, key: Hashable, builder: Callable[[], Any], ttl_seconds: float = fee_cache_ttl_seconds) -> Any:
+    with _lock:
+        statistics = _statistics.setdefault(name, {"hits": 0, "misses": 0, "last_build_seconds": None,
+                                                   "total_build_seconds": 0.0, "key": None})
+        entry = _entries.get(name)
+        if entry is not None and entry["key"] == key and time.monotonic() - entry["built_at"] < ttl_seconds:
+            statistics["hits"] += 1
+            return entry["value"]
+        statistics["misses"] += 1
+
+    # build outside the lock so one slow rebuild doesn't block hits on the other entries
+    started = time.perf_counter()
+    value = builder()
+    build_seconds = time.perf_counter() - started
+
+    with _lock:
+        _entries[name] = {"key": key, "built_at": time.monotonic(), "value": value}
+        statistics["last_build_seconds"] = build_seconds
+        statistics["total_build_seconds"] += build_seconds
+        statistics["key"] = str(key)
+
+    return value
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def cache_statistics() -> pd.DataFrame:
+    with _lock:
+        return pd.DataFrame.from_dict(_statistics, orient='index', columns=["hits", "misses", "last_build_seconds",
+                                                                            "total_build_seconds", "key"])
@@ -0,0 +1,133 @@
+from fee_scenarios import build_fee_baseline, evaluate_fee_scenarios, scenarios_to_frame
+from unique_fees import return_unique_fees, build_security_counter, calculate_security_counter
+from access_fees import return_access_fees, build_daily_accesses
+from request_summaries import read_summary, summary_version
+from billing_history import read_billing_history, read_opening_balances
+from data_loader import load_base_data
+from creds import access_aggregation_mode, request_snapshot_directory, request_summary_directory
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Union
+import pandas as pd
+import itertools
+import argparse
+import json
+import os
+
+# set once per worker process so the inputs cross the process boundary once rather than once per period
+_security_counter = None
+_daily_accesses = None
+_billing_history = None
+
+
+def read_scenarios(path: str) -> pd.DataFrame:
+    # a json list of scenario objects or a csv, both with the columns the dashboard's scenario table uses
+    if path.endswith(".json"):
+        with open(path) as f:
+            scenarios = json.load(f)
+    else:
+        scenarios = pd.read_csv(path)
+
+    return scenarios_to_frame(scenarios)
+
+
+def load_fee_inputs() -> (pd.DataFrame, pd.DataFrame):
+    # the same security counter and daily accesses the dashboard prices from, summaries first when there are any
+    if request_summary_directory and request_snapshot_directory and summary_version() is not None:
+        return calculate_security_counter(read_summary("category_month_securities"), read_opening_balances(),
+                                          read_billing_history()), \
+            read_summary("daily_accesses")
+
+    base_data = load_base_data()
+    # a report on an earlier period prices it from its own requests, so no month is left out as closed here
+    return build_security_counter(base_data), \
+        build_daily_accesses(base_data if access_aggregation_mode == "memory" else None,
+                             billing_history=read_billing_history().iloc[0:0])
+
+
+def initialise_worker(security_counter: pd.DataFrame, daily_accesses: pd.DataFrame, billing_history: pd.DataFrame):
+    global _security_counter, _daily_accesses, _billing_history
+    _security_counter, _daily_accesses, _billing_history = security_counter, daily_accesses, billing_history
+
+
+def report_period(period: pd.Period, scenarios: pd.DataFrame, out_of_band: str = "raise") -> pd.DataFrame:
+    # price every scenario as if the period were the latest month, on top of what had accrued by its end
+    security_counter = _security_counter.loc[
+        pd.DatetimeIndex(_security_counter['timestamp']).to_period('M') <= period].reset_index(drop=True)
+    daily_accesses = _daily_accesses.loc[_daily_accesses['timestamp'].dt.to_period('M') <= period]
+    if security_counter.empty or daily_accesses.empty:
+        raise ValueError(f"No requests up to {period} to report on")
+
+    # only the months that had been invoiced by the end of the period count as closed in it
+    billing_history = _billing_history.loc[_billing_history['Month'].dt.to_period('M') <= period]
+
+    accrued_unique_fees = return_unique_fees(security_counter=security_counter, billing_history=billing_history)[2]
+    # an empty modifier still forward fills the latest day's accesses to month end
+    _, accrued_access_fees, projected_access_fees, _ = return_access_fees([], daily_accesses=daily_accesses,
+                                                                          billing_history=billing_history)
+
+    report = evaluate_fee_scenarios(build_fee_baseline(security_counter, daily_accesses), scenarios, out_of_band)
+    report.insert(0, 'period', str(period))
+    report['accrued_unique_fees'] = accrued_unique_fees
+    report['accrued_access_fees'] = accrued_access_fees
+    report['projected_access_fees'] = projected_access_fees
+    report['total_fees'] = accrued_unique_fees + accrued_access_fees + projected_access_fees + \
+        report['total_fee_delta']
+
+    return report
+
+
+def run_fee_report(security_counter: pd.DataFrame, daily_accesses: pd.DataFrame, scenarios: pd.DataFrame,
+                   periods: List[pd.Period], workers: int = 1, out_of_band: str = "raise",
+                   billing_history: Union[pd.DataFrame, None] = None) -> pd.DataFrame:
+    if billing_history is None:
+        billing_history = read_billing_history()
+
+    # scenarios within a period are priced in one vectorised pass, so the pool splits the work by period
+    if workers <= 1 or len(periods) <= 1:
+        initialise_worker(security_counter, daily_accesses, billing_history)
+        reports = [report_period(period, scenarios, out_of_band) for period in periods]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(periods)), initializer=initialise_worker,
+                                 initargs=(security_counter, daily_accesses, billing_history)) as executor:
+            reports = list(executor.map(report_period, periods, itertools.repeat(scenarios),
+                                        itertools.repeat(out_of_band)))
+
+    return pd.concat(reports, ignore_index=True)
+
+
+def write_report(report: pd.DataFrame, path: str):
+    if path.endswith(".parquet"):
+        report.to_parquet(path, index=False)
+    else:
+        report.to_csv(path, index=False)
+
+
+def default_periods(security_counter: pd.DataFrame, periods: Union[List[str], None]) -> List[pd.Period]:
+    if periods:
+        return [pd.Period(period, freq='M') for period in periods]
+    return [pd.Period(security_counter['timestamp'].max(), freq='M')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Price a file of what-if scenarios without the dashboard")
+    parser.add_argument("scenarios", help="json or csv with Scenario, Data Category, Number of Securities and "
+                                          "Frequency per Day columns")
+    parser.add_argument("--output", required=True, help="report path, .parquet or .csv")
+    parser.add_argument("--periods", nargs="*", help="months to report as YYYY-MM, the latest month by default")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes to spread the periods over")
+    parser.add_argument("--out-of-band", choices=["raise", "cap"], default="raise",
+                        help="fail on counts no band covers or price them at the nearest band")
+    arguments = parser.parse_args()
+
+    try:
+        scenario_table = read_scenarios(arguments.scenarios)
+        loaded_security_counter, loaded_daily_accesses = load_fee_inputs()
+        fee_report = run_fee_report(loaded_security_counter, loaded_daily_accesses, scenario_table,
+                                    default_periods(loaded_security_counter, arguments.periods), arguments.workers,
+                                    arguments.out_of_band)
+    except ValueError as error:
+        parser.error(str(error))
+
+    write_report(fee_report, arguments.output)
+    print(f"{len(fee_report)} scenario rows over {fee_report['period'].nunique()} periods written to "
+          f"{arguments.output}")
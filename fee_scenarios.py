@@ -0,0 +1,83 @@
+from fee_schedule import FeeSchedule, load_fee_schedules, schedule_in_effect, lookup_monthly_unique_fees
+from access_fees import remaining_business_days
+from typing import Dict, List, NamedTuple, Union
+from profiling import profiled
+import pandas as pd
+import numpy as np
+
+
+class FeeBaseline(NamedTuple):
+    latest_month: object
+    latest_security_counts: pd.Series
+    fee_bands: Dict[str, tuple]
+    access_fee_mapping: Dict[str, float]
+    remaining_business_days: int
+
+
+def build_fee_baseline(security_counter: pd.DataFrame, daily_accesses: pd.DataFrame,
+                       fee_schedule: Union[FeeSchedule, None] = None) -> FeeBaseline:
+    # everything a scenario needs from the baseline, computed once and shared by every scenario. scenarios land in the
+    # latest month, so they're priced under the schedule in effect then
+    latest_month = security_counter['timestamp'].max()
+    if fee_schedule is None:
+        fee_schedule = schedule_in_effect(load_fee_schedules(), latest_month)
+
+    latest_security_counts = security_counter.loc[security_counter['timestamp'] == latest_month].groupby(
+        'data_category')['number_of_cumulative_securities'].sum()
+
+    return FeeBaseline(latest_month=latest_month, latest_security_counts=latest_security_counts,
+                       fee_bands=fee_schedule.fee_bands, access_fee_mapping=fee_schedule.access_fee_mapping,
+                       # nothing accessed yet leaves no day to project the rest of the month from
+                       remaining_business_days=len(remaining_business_days(daily_accesses['timestamp'].max()))
+                       if not daily_accesses.empty else 0)
+
+
+def scenarios_to_frame(scenarios: Union[List[dict], pd.DataFrame]) -> pd.DataFrame:
+    scenarios = pd.DataFrame(scenarios, columns=["Scenario", "Data Category", "Number of Securities",
+                                                 "Frequency per Day"])
+    scenarios['Scenario'] = scenarios['Scenario'].fillna(pd.Series(
+        [f"Scenario {i + 1}" for i in range(len(scenarios))], index=scenarios.index))
+    scenarios[['Number of Securities', 'Frequency per Day']] = scenarios[
+        ['Number of Securities', 'Frequency per Day']].fillna(0)
+
+    if (scenarios[['Number of Securities', 'Frequency per Day']] < 0).any(axis=None):
+        raise ValueError("Scenario securities and frequencies can't be negative")
+
+    return scenarios
+
+
+@profiled("scenarios.evaluate")
+def evaluate_fee_scenarios(baseline: FeeBaseline, scenarios: Union[List[dict], pd.DataFrame],
+                           out_of_band: str = "raise") -> pd.DataFrame:
+    scenarios = scenarios_to_frame(scenarios)
+    data_categories = scenarios['Data Category']
+    added_securities = scenarios['Number of Securities'].to_numpy(dtype=float)
+
+    # unique fees only move in the latest month, by the band price difference the added securities cause
+    current_securities = data_categories.map(baseline.latest_security_counts)
+    in_latest_month = current_securities.notna().to_numpy()
+    unique_fee_delta = np.zeros(len(scenarios))
+    if in_latest_month.any():
+        current = current_securities[in_latest_month]
+        categories = data_categories[in_latest_month]
+        unique_fee_delta[in_latest_month] = \
+            lookup_monthly_unique_fees(categories, current + added_securities[in_latest_month], baseline.fee_bands,
+                                       out_of_band) - \
+            lookup_monthly_unique_fees(categories, current, baseline.fee_bands, out_of_band)
+
+    # each added security is called at the given frequency on every business day left in the month
+    access_rates = data_categories.map(baseline.access_fee_mapping)
+    if access_rates.isna().any():
+        raise ValueError(f"No access fee rate for data category {data_categories[access_rates.isna()].iloc[0]!r}")
+    access_fee_delta = added_securities * scenarios['Frequency per Day'].to_numpy(dtype=float) * \
+        access_rates.to_numpy() * baseline.remaining_business_days
+
+    return pd.DataFrame({'scenario': scenarios['Scenario'],
+                         'data_category': data_categories,
+                         'added_securities': added_securities,
+                         'frequency_per_day': scenarios['Frequency per Day'],
+                         'number_of_cumulative_securities': current_securities.fillna(0) + np.where(
+                             in_latest_month, added_securities, 0),
+                         'unique_fee_delta': unique_fee_delta,
+                         'access_fee_delta': access_fee_delta,
+                         'total_fee_delta': unique_fee_delta + access_fee_delta})
@@ -0,0 +1,239 @@
+from fee_cache import file_hash
+from typing import Dict, Iterable, List, NamedTuple, Union
+import pandas as pd
+import numpy as np
+import threading
+import os
+
+# band prices and per access rates. a row applies from the month in its effective from until a later row for the
+# same data category takes over, an empty effective from has applied since before the request history starts
+FEE_BANDS_PATH = "unique_fee_reference_sheet.csv"
+ACCESS_FEE_RATES_PATH = "access_fee_rates.csv"
+
+FEE_BANDS_COLUMNS = ["Data Category", "Lower Bound", "Upper Bound", "Price per annum", "Effective From"]
+ACCESS_FEE_RATES_COLUMNS = ["Data Category", "Price per Access", "Effective From"]
+
+# schedules compiled from each pair of files, with the signatures and hashes of the files they were compiled from
+_compiled = {}
+_lock = threading.Lock()
+
+
+class FeeSchedule(NamedTuple):
+    # None when the schedule has applied since before the request history starts
+    effective_from: Union[pd.Timestamp, None]
+    fee_bands: Dict[str, tuple]
+    access_fee_mapping: Dict[str, float]
+    band_table: pd.DataFrame
+
+
+def read_versioned_table(path: str, columns: List[str]) -> pd.DataFrame:
+    table = pd.read_csv(path)
+    # a sheet without effective dates is a single schedule that has always applied
+    if "Effective From" not in table:
+        table["Effective From"] = None
+    missing = [column for column in columns if column not in table]
+    if missing:
+        raise ValueError(f"{path} is missing the {', '.join(missing)} column(s)")
+    if table[columns[:-1]].isna().any(axis=None):
+        raise ValueError(f"{path} has empty values outside the Effective From column")
+
+    table["Effective From"] = pd.to_datetime(table["Effective From"])
+    # fees are billed by month, so a schedule can only change on the first of one
+    mid_month = table["Effective From"].notna() & (table["Effective From"].dt.day != 1)
+    if mid_month.any():
+        raise ValueError(f"{path} effective dates must fall on the first of a month, got "
+                         f"{table.loc[mid_month, 'Effective From'].iloc[0]:%Y-%m-%d}")
+
+    return table[columns]
+
+
+def effective_label(effective_from: pd.Timestamp) -> str:
+    return "from the start" if pd.isna(effective_from) else f"from {effective_from:%Y-%m}"
+
+
+def read_fee_bands(path: str = FEE_BANDS_PATH) -> pd.DataFrame:
+    bands = read_versioned_table(path, FEE_BANDS_COLUMNS)
+    validate_fee_bands(bands)
+    return bands
+
+
+def validate_fee_bands(bands: pd.DataFrame):
+    # every version of a category's bands has to run on from one band to the next without gaps or overlaps,
+    # otherwise the sorted lookup would price counts in a gap at the next band up
+    if (bands[["Lower Bound", "Upper Bound"]] % 1 != 0).any(axis=None):
+        raise ValueError("Fee band bounds must be whole numbers of securities")
+    if (bands["Price per annum"] < 0).any():
+        raise ValueError("Fee band prices can't be negative")
+
+    for (data_category, effective_from), version in bands.groupby(["Data Category", "Effective From"], dropna=False):
+        version = version.sort_values(by="Lower Bound")
+        lower_bounds, upper_bounds = version["Lower Bound"].to_numpy(), version["Upper Bound"].to_numpy()
+        label = f"{data_category} fee bands {effective_label(effective_from)}"
+
+        if (empty := lower_bounds > upper_bounds).any():
+            raise ValueError(f"{label} have a band from {lower_bounds[empty][0]:g} down to {upper_bounds[empty][0]:g}")
+        if (overlap := lower_bounds[1:] <= upper_bounds[:-1]).any():
+            raise ValueError(f"{label} overlap, a band starts at {lower_bounds[1:][overlap][0]:g} before the one "
+                             f"below it ends at {upper_bounds[:-1][overlap][0]:g}")
+        if (gap := lower_bounds[1:] > upper_bounds[:-1] + 1).any():
+            raise ValueError(f"{label} leave a gap between {upper_bounds[:-1][gap][0]:g} and "
+                             f"{lower_bounds[1:][gap][0]:g}")
+
+
+def read_access_fee_rates(path: str = ACCESS_FEE_RATES_PATH) -> pd.DataFrame:
+    rates = read_versioned_table(path, ACCESS_FEE_RATES_COLUMNS)
+    if (rates["Price per Access"] < 0).any():
+        raise ValueError("Access fee rates can't be negative")
+    if rates.duplicated(subset=["Data Category", "Effective From"]).any():
+        raise ValueError(f"{path} has more than one rate for the same data category and effective date")
+    return rates
+
+
+def rows_in_effect(table: pd.DataFrame, month: pd.Timestamp) -> pd.DataFrame:
+    # each category's latest version that had started by the month
+    table = table.assign(start=table["Effective From"].fillna(pd.Timestamp.min))
+    table = table.loc[table["start"] <= month]
+    latest = table.groupby("Data Category")["start"].transform("max")
+    return table.loc[table["start"] == latest].drop(columns=["start"])
+
+
+def compile_fee_bands(bands: pd.DataFrame) -> Dict[str, tuple]:
+    # sorted (lower bounds, upper bounds, monthly price) arrays per data category
+    bands = bands.sort_values(by=['Data Category', 'Lower Bound'])
+
+    return {data_category: (version['Lower Bound'].to_numpy(), version['Upper Bound'].to_numpy(),
+                            version['Price per annum'].to_numpy() / 12)
+            for data_category, version in bands.groupby('Data Category')}
+
+
+def compile_fee_schedules(bands: pd.DataFrame, rates: pd.DataFrame) -> List[FeeSchedule]:
+    # one schedule per date either file changes on, each holding every category's bands and rate in effect then
+    starts = sorted(set(bands["Effective From"].fillna(pd.Timestamp.min)) |
+                    set(rates["Effective From"].fillna(pd.Timestamp.min)))
+
+    schedules = []
+    for start in starts:
+        bands_in_effect = rows_in_effect(bands, start)
+        rates_in_effect = rows_in_effect(rates, start)
+        schedules.append(FeeSchedule(
+            effective_from=None if start == pd.Timestamp.min else start,
+            fee_bands=compile_fee_bands(bands_in_effect),
+            access_fee_mapping=dict(zip(rates_in_effect["Data Category"], rates_in_effect["Price per Access"])),
+            band_table=bands_in_effect.drop(columns=["Effective From"]).reset_index(drop=True)))
+
+    return schedules
+
+
+def file_signature(path: str) -> tuple:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_fee_schedules(bands_path: str = FEE_BANDS_PATH,
+                       rates_path: str = ACCESS_FEE_RATES_PATH) -> List[FeeSchedule]:
+    # compiled once per process and only read again when a file's mtime moves and its contents hash differently,
+    # so an edit is picked up on the next page load without a restart
+    paths = (bands_path, rates_path)
+    signatures = tuple(file_signature(path) for path in paths)
+
+    with _lock:
+        compiled = _compiled.get(paths)
+        if compiled is not None and compiled["signatures"] == signatures:
+            return compiled["schedules"]
+
+        hashes = tuple(file_hash(path) for path in paths)
+        if compiled is not None and compiled["hashes"] == hashes:
+            compiled["signatures"] = signatures
+            return compiled["schedules"]
+
+        schedules = compile_fee_schedules(read_fee_bands(bands_path), read_access_fee_rates(rates_path))
+        _compiled[paths] = {"signatures": signatures, "hashes": hashes, "schedules": schedules}
+
+        return schedules
+
+
+def fee_schedule_version(bands_path: str = FEE_BANDS_PATH, rates_path: str = ACCESS_FEE_RATES_PATH) -> tuple:
+    # content hashes of the files the current schedules were compiled from, for cache keys
+    load_fee_schedules(bands_path, rates_path)
+    with _lock:
+        return _compiled[(bands_path, rates_path)]["hashes"]
+
+
+def schedule_positions(fee_schedules: List[FeeSchedule], months: Iterable) -> np.ndarray:
+    # index of the schedule in effect for each month
+    months = pd.DatetimeIndex(months).to_numpy()
+    starts = pd.DatetimeIndex([schedule.effective_from or pd.Timestamp.min for schedule in fee_schedules]).to_numpy()
+    positions = np.searchsorted(starts, months, side='right') - 1
+
+    if (before := positions < 0).any():
+        raise ValueError(f"No fee schedule in effect for {pd.Timestamp(months[before].min()):%Y-%m}, the earliest "
+                         f"starts {effective_label(fee_schedules[0].effective_from) if fee_schedules else 'never'}")
+
+    return positions
+
+
+def schedule_in_effect(fee_schedules: List[FeeSchedule], month) -> FeeSchedule:
+    return fee_schedules[schedule_positions(fee_schedules, [month])[0]]
+
+
+def lookup_monthly_unique_fees(data_categories: pd.Series, number_of_securities: pd.Series,
+                               fee_bands: Dict[str, tuple], out_of_band: str = "raise") -> np.ndarray:
+    # out_of_band="raise" fails on counts no band covers, "cap" prices them at the nearest band instead
+    if out_of_band not in ("raise", "cap"):
+        raise ValueError(f"out_of_band must be 'raise' or 'cap', got {out_of_band!r}")
+
+    data_categories = data_categories.to_numpy()
+    number_of_securities = number_of_securities.to_numpy()
+    monthly_fees = np.empty(len(number_of_securities))
+
+    for data_category in pd.unique(data_categories):
+        if data_category not in fee_bands:
+            raise ValueError(f"No unique fee bands for data category {data_category!r}")
+
+        lower_bounds, upper_bounds, monthly_prices = fee_bands[data_category]
+        in_category = data_categories == data_category
+        counts = number_of_securities[in_category]
+        if out_of_band == "cap":
+            counts = np.clip(counts, lower_bounds[0], upper_bounds[-1])
+
+        band = np.minimum(np.searchsorted(upper_bounds, counts, side='left'), len(upper_bounds) - 1)
+        outside = (counts > upper_bounds[band]) | (counts < lower_bounds[band])
+        if outside.any():
+            raise ValueError(f"No {data_category} unique fee band covers {counts[outside][0]:g} securities, bands run "
+                             f"from {lower_bounds[0]} to {upper_bounds[-1]}")
+
+        monthly_fees[in_category] = monthly_prices[band]
+
+    return monthly_fees
+
+
+def lookup_unique_fees_by_month(data_categories: pd.Series, months: pd.Series, number_of_securities: pd.Series,
+                                fee_schedules: List[FeeSchedule], out_of_band: str = "raise") -> np.ndarray:
+    # each month is priced by the bands in effect at the time, one band lookup per schedule the months fall under
+    positions = schedule_positions(fee_schedules, months)
+    monthly_fees = np.empty(len(positions))
+
+    for position in np.unique(positions):
+        in_schedule = positions == position
+        monthly_fees[in_schedule] = lookup_monthly_unique_fees(data_categories[in_schedule],
+                                                               number_of_securities[in_schedule],
+                                                               fee_schedules[position].fee_bands, out_of_band)
+
+    return monthly_fees
+
+
+def lookup_access_rates_by_month(data_categories: pd.Series, months: pd.Series,
+                                 fee_schedules: List[FeeSchedule]) -> np.ndarray:
+    positions = schedule_positions(fee_schedules, months)
+    data_categories = data_categories.to_numpy()
+    rates = np.empty(len(positions))
+
+    for position in np.unique(positions):
+        in_schedule = positions == position
+        rates[in_schedule] = pd.Series(data_categories[in_schedule]).map(
+            fee_schedules[position].access_fee_mapping).to_numpy(dtype=float)
+
+    if (missing := np.isnan(rates)).any():
+        raise ValueError(f"No access fee rate for data category {data_categories[missing][0]!r}")
+
+    return rates
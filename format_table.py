@@ -1,15 +1,10 @@
 import pandas as pd
 
 
+# formatting only happens here, at display time, the pipelines hand over plain numeric frames
 def format_values_in_fee_table(table: pd.DataFrame):
-    for column in table.columns:
-        table[column] = table[column].apply(lambda x: "${:.2f}".format(x))
-
-    return table
+    return table.style.format("${:,.2f}")
 
 
 def format_values_in_count_table(table: pd.DataFrame):
-    for column in table.columns:
-        table[column] = table[column].apply(lambda x: "{:.0f}".format(x))
-
-    return table
+    return table.style.format("{:,.0f}")
@@ -0,0 +1,98 @@
+from creds import profiling_enabled, profiling_log_path
+from typing import Callable, List, Union
+import pandas as pd
+import contextvars
+import contextlib
+import functools
+import threading
+import resource
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger("profiling")
+
+# the records of the run the current code belongs to. each streamlit session runs its script on its own thread, so
+# sessions never see each other's stages, and threads started without a run (the summary refresher) record nowhere
+_current_run = contextvars.ContextVar("profiling_run", default=None)
+_lock = threading.Lock()
+
+
+def resident_memory_bytes() -> int:
+    # current rss from procfs on linux (the container), peak rss anywhere else
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_rows(value) -> Union[int, None]:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, tuple):
+        rows = [len(item) for item in value if isinstance(item, (pd.DataFrame, pd.Series))]
+        return sum(rows) if rows else None
+    return None
+
+
+def record_stage(record: dict):
+    if (run := _current_run.get()) is not None:
+        with _lock:
+            run.append(record)
+
+    logger.info(json.dumps(record))
+    if profiling_log_path:
+        with _lock, open(profiling_log_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def start_run() -> List[dict]:
+    run = []
+    _current_run.set(run)
+    return run
+
+
+def last_run(run: Union[List[dict], None] = None) -> pd.DataFrame:
+    run = run if run is not None else _current_run.get() or []
+    with _lock:
+        return pd.DataFrame(list(run), columns=["stage", "wall_seconds", "rows_in", "rows_out", "memory_delta_mb",
+                                                "started_at"])
+
+
+@contextlib.contextmanager
+def stage(name: str, rows_in: Union[int, None] = None):
+    # callers can set record["rows_out"] inside the block
+    if not profiling_enabled:
+        yield {}
+        return
+
+    record = {"stage": name, "rows_in": rows_in, "rows_out": None, "started_at": time.time()}
+    memory_before = resident_memory_bytes()
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = time.perf_counter() - started
+        record["memory_delta_mb"] = (resident_memory_bytes() - memory_before) / 2 ** 20
+        record_stage(record)
+
+
+def profiled(name: str) -> Callable:
+    def decorator(function: Callable) -> Callable:
+        # decided once at import, a disabled profiler hands back the undecorated function
+        if not profiling_enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            rows_in = [len(arg) for arg in (*args, *kwargs.values()) if isinstance(arg, (pd.DataFrame, pd.Series))]
+            with stage(name, sum(rows_in) if rows_in else None) as record:
+                value = function(*args, **kwargs)
+                record["rows_out"] = count_rows(value)
+            return value
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,209 @@
+from creds import request_chunk_size, request_snapshot_id_overlap
+from typing import Dict, Iterator, List, Union
+from sqlalchemy import text
+from profiling import profiled
+import sqlalchemy as sql
+import pandas as pd
+import numpy as np
+import contextlib
+import fcntl
+import json
+import glob
+import os
+
+SNAPSHOT_COLUMNS = ['id', 'timestamp', 'dataset_id', 'success']
+FULL_QUERY = "SELECT id, timestamp, dataset_id, success FROM requests"
+DELTA_QUERY = "SELECT id, timestamp, dataset_id, success FROM requests WHERE id > :overlap_from"
+# leading underscore keeps pyarrow from treating the file as part of the dataset. besides the mark it lists the
+# files that make up the snapshot with the highest id in each, a file only counts once the mark naming it is written
+HIGH_WATER_MARK_FILE = "_high_water_mark.json"
+# a month's delta files are merged into one once it has this many
+COMPACT_AFTER_FILES = 24
+# held while a refresh writes to the directory
+LOCK_FILE = "_refresh.lock"
+
+
+@contextlib.contextmanager
+def directory_lock(directory: str) -> Iterator[None]:
+    # refreshes run from the app, the external summary refresher and the fee report, each in its own process, and
+    # would otherwise hand out the same file numbers and remove each other's unlisted files. the flock is taken on a
+    # descriptor of its own, so threads of one process wait on it as well
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def snapshot_file_name(month: pd.Timestamp, sequence: int) -> str:
+    # files are never rewritten in place, every write gets a new sequence number
+    return f"requests_{month:%Y-%m}_{sequence:08d}.parquet"
+
+
+def file_month(file_name: str) -> str:
+    return file_name[len("requests_"):len("requests_YYYY-MM")]
+
+
+def read_high_water_mark(directory: str) -> Union[dict, None]:
+    path = os.path.join(directory, HIGH_WATER_MARK_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        high_water_mark = json.load(f)
+
+    # snapshots written before the file list was kept are rebuilt
+    return high_water_mark if "files" in high_water_mark else None
+
+
+def write_high_water_mark(directory: str, high_water_mark: dict):
+    path = os.path.join(directory, HIGH_WATER_MARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(high_water_mark, f)
+    os.replace(path + ".tmp", path)
+
+
+def clear_snapshot(directory: str):
+    for path in glob.glob(os.path.join(directory, "requests_*.parquet")):
+        os.remove(path)
+
+    if os.path.exists(path := os.path.join(directory, HIGH_WATER_MARK_FILE)):
+        os.remove(path)
+
+
+def remove_unlisted_files(directory: str, high_water_mark: dict):
+    # left behind by compaction or by a refresh that died before writing its mark
+    for path in glob.glob(os.path.join(directory, "requests_*.parquet")):
+        if os.path.basename(path) not in high_water_mark["files"]:
+            os.remove(path)
+
+
+def fetch_new_requests(engine: sql.engine.Engine, overlap_from: Union[int, None],
+                       chunk_size: int = request_chunk_size) -> Iterator[pd.DataFrame]:
+    # read off a server side cursor a chunk at a time, so a cold start never holds the whole table
+    query, params = (FULL_QUERY, {}) if overlap_from is None else (DELTA_QUERY, {"overlap_from": overlap_from})
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        for requests in pd.read_sql(text(query), conn, params=params, parse_dates=['timestamp'],
+                                    chunksize=chunk_size):
+            yield normalise_types(requests)
+
+
+def normalise_types(requests: pd.DataFrame) -> pd.DataFrame:
+    requests = requests[SNAPSHOT_COLUMNS].copy()
+    requests['id'] = requests['id'].astype('int64')
+    requests['timestamp'] = pd.to_datetime(requests['timestamp']).astype('datetime64[ns]')
+    requests['dataset_id'] = requests['dataset_id'].astype('int64')
+    requests['success'] = requests['success'].astype('int8')
+    return requests
+
+
+def stored_ids_from(directory: str, high_water_mark: dict, overlap_from: int) -> np.ndarray:
+    # ids already in the snapshot that the overlap reads again. only files whose highest id is past the overlap start
+    # can hold one, which are the last few deltas, and only their id column is read
+    ids = [pd.read_parquet(os.path.join(directory, file_name), columns=['id'],
+                           filters=[('id', '>', overlap_from)])['id'].to_numpy()
+           for file_name, max_id in high_water_mark["files"].items() if max_id > overlap_from]
+    return np.concatenate(ids) if ids else np.array([], dtype='int64')
+
+
+def append_delta_files(directory: str, high_water_mark: dict, new_requests: pd.DataFrame):
+    # each month a delta touches gets a file of its own, nothing already on disk is read or rewritten
+    months = new_requests['timestamp'].dt.to_period('M').dt.to_timestamp()
+
+    for month, rows in new_requests.groupby(months):
+        file_name = snapshot_file_name(month, high_water_mark["next_file"])
+        path = os.path.join(directory, file_name)
+        rows.sort_values(by=['id']).to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+        high_water_mark["next_file"] += 1
+        high_water_mark["files"][file_name] = int(rows['id'].max())
+
+
+def compact_months(directory: str, high_water_mark: dict):
+    # merge a month's deltas once there are enough of them that reading them one by one costs more than the merge.
+    # the merged file replaces them in the list, the old files go on the next refresh
+    for month, file_names in snapshot_months(high_water_mark).items():
+        if len(file_names) < COMPACT_AFTER_FILES:
+            continue
+
+        rows = pd.concat([pd.read_parquet(os.path.join(directory, file_name)) for file_name in file_names],
+                         ignore_index=True)
+        merged = snapshot_file_name(pd.Timestamp(month), high_water_mark["next_file"])
+        path = os.path.join(directory, merged)
+        rows.drop_duplicates(subset=['id'], keep='last').sort_values(by=['id']).to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+        high_water_mark["next_file"] += 1
+        for file_name in file_names:
+            del high_water_mark["files"][file_name]
+        high_water_mark["files"][merged] = int(rows['id'].max())
+
+
+@profiled("load.snapshot_refresh")
+def refresh_snapshot(engine: sql.engine.Engine, directory: str, rebuild: bool = False,
+                     id_overlap: int = request_snapshot_id_overlap) -> int:
+    with directory_lock(directory):
+        # cold start pulls the whole table, warm start only the rows past the high water mark, plus an overlap below
+        # it for rows that committed after a higher id had already been read
+        high_water_mark = None if rebuild else read_high_water_mark(directory)
+        if high_water_mark is None:
+            clear_snapshot(directory)
+            high_water_mark = {"id": 0, "timestamp": None, "files": {}, "next_file": 0}
+            overlap_from, stored_ids = None, np.array([], dtype='int64')
+        else:
+            remove_unlisted_files(directory, high_water_mark)
+            overlap_from = max(high_water_mark["id"] - id_overlap, 0)
+            stored_ids = stored_ids_from(directory, high_water_mark, overlap_from)
+
+        # the mark only moves once every chunk is written, a refresh that dies part way leaves files the mark doesn't
+        # list, which are ignored and later removed, and the rows are fetched again next time
+        fetched = 0
+        for new_requests in fetch_new_requests(engine, overlap_from):
+            new_requests = new_requests.loc[~new_requests['id'].isin(stored_ids)]
+            if new_requests.empty:
+                continue
+            append_delta_files(directory, high_water_mark, new_requests)
+            fetched += len(new_requests)
+            high_water_mark["id"] = max(high_water_mark["id"], int(new_requests['id'].max()))
+            newest_timestamp = str(new_requests['timestamp'].max())
+            high_water_mark["timestamp"] = max(high_water_mark["timestamp"] or newest_timestamp, newest_timestamp)
+
+        if not fetched and overlap_from is not None:
+            return 0
+
+        compact_months(directory, high_water_mark)
+        write_high_water_mark(directory, high_water_mark)
+
+        return fetched
+
+
+def snapshot_months(high_water_mark: Union[dict, None]) -> Dict[str, List[str]]:
+    # the files holding each month's requests, in the order they were written
+    months = {}
+    for file_name in (high_water_mark or {"files": {}})["files"]:
+        months.setdefault(file_month(file_name), []).append(file_name)
+    return dict(sorted(months.items()))
+
+
+def read_snapshot_files(directory: str, file_names: List[str]) -> pd.DataFrame:
+    if not file_names:
+        return normalise_types(pd.DataFrame(columns=SNAPSHOT_COLUMNS))
+
+    return pd.concat([pd.read_parquet(os.path.join(directory, file_name), memory_map=True)
+                      for file_name in file_names], ignore_index=True)
+
+
+def iterate_snapshot(directory: str) -> Iterator[pd.DataFrame]:
+    # one month at a time, for callers that fold the requests rather than hold them all
+    for file_names in snapshot_months(read_high_water_mark(directory)).values():
+        yield read_snapshot_files(directory, file_names)
+
+
+@profiled("load.snapshot_read")
+def read_snapshot(directory: str) -> pd.DataFrame:
+    high_water_mark = read_high_water_mark(directory)
+    return read_snapshot_files(directory, list(high_water_mark["files"]) if high_water_mark else [])
@@ -0,0 +1,190 @@
+from creds import request_snapshot_directory, request_summary_directory, summary_refresh_interval_seconds
+from data_loader import BaseData, get_engine, successful_requests, load_dataset_tables, compact_requests, \
+    compact_datasets, compact_dataset_names
+from request_snapshot import refresh_snapshot, read_high_water_mark, read_snapshot_files, snapshot_months, \
+    normalise_types, directory_lock, SNAPSHOT_COLUMNS
+from unique_fees import squash_dataset_table_and_merge_with_request_table
+from access_fees import calculate_number_of_new_accesses_per_day
+from requests_plot import count_requests_by_day
+from dataset_breakdown import requested_datasets_by_month
+from typing import Dict, List, Union
+from profiling import profiled
+import sqlalchemy as sql
+import pandas as pd
+import threading
+import argparse
+import logging
+import hashlib
+import json
+import os
+
+# every dashboard number comes from one of these, each small next to the raw requests they summarise
+SUMMARIES = ["category_month_securities", "daily_accesses", "request_counts", "requested_datasets"]
+SUMMARY_STATE_FILE = "_summary_state.json"
+# bumped whenever a summary's columns or types change, a store written by another format is rebuilt
+SUMMARY_FORMAT = 4
+
+logger = logging.getLogger("request_summaries")
+_refresher_lock = threading.Lock()
+_refresher_thread = None
+
+
+def summary_path(directory: str, summary: str) -> str:
+    return os.path.join(directory, f"{summary}.parquet")
+
+
+def read_summary_state(directory: str) -> Union[dict, None]:
+    path = os.path.join(directory, SUMMARY_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_summary_state(directory: str, state: dict):
+    path = os.path.join(directory, SUMMARY_STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def summary_version(directory: str = request_summary_directory) -> Union[int, None]:
+    # high water mark the summaries were built up to, None until the first refresh has finished
+    state = read_summary_state(directory) if directory else None
+    return state["high_water_mark"] if state is not None else None
+
+
+def frame_hash(*frames: pd.DataFrame) -> str:
+    # row order out of the database isn't fixed, so sort before hashing
+    digest = hashlib.sha256()
+    for frame in frames:
+        frame = frame.sort_values(by=list(frame.columns)).reset_index(drop=True)
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def summarise_requests(base_data: BaseData) -> Dict[str, pd.DataFrame]:
+    # the same aggregates the dashboard would otherwise build from every raw row
+    return {"category_month_securities": squash_dataset_table_and_merge_with_request_table(
+                base_data.datasets, successful_requests(base_data)),
+            "daily_accesses": calculate_number_of_new_accesses_per_day(
+                base_data.datasets, base_data.requests[['timestamp', 'dataset_id']]),
+            "request_counts": count_requests_by_day(base_data),
+            "requested_datasets": requested_datasets_by_month(base_data.requests)}
+
+
+def summary_months(summary: pd.DataFrame) -> pd.Index:
+    return pd.DatetimeIndex(summary['timestamp']).to_period('M')
+
+
+@profiled("summaries.refresh")
+def refresh_summaries(engine: Union[sql.engine.Engine, None] = None,
+                      snapshot_directory: str = request_snapshot_directory,
+                      summary_directory: str = request_summary_directory, rebuild: bool = False) -> List[str]:
+    # summarise only the snapshot months that changed since the last run, every summary row belongs to one month
+    engine = engine if engine is not None else get_engine()
+
+    with directory_lock(summary_directory):
+        refresh_snapshot(engine, snapshot_directory)
+        # snapshot files are never rewritten, so a month needs summarising again once its list of files changes
+        partitions = snapshot_months(read_high_water_mark(snapshot_directory))
+
+        datasets, dataset_names = load_dataset_tables(engine)
+
+        # universes and field lists change every month's securities, so a change there summarises everything again
+        datasets_hash = frame_hash(datasets, dataset_names)
+        state = None if rebuild else read_summary_state(summary_directory)
+        if state is None or state.get("format") != SUMMARY_FORMAT or state["datasets_hash"] != datasets_hash:
+            state = None
+            changed = list(partitions)
+        else:
+            changed = [month for month, file_names in partitions.items()
+                       if state["partitions"].get(month) != file_names]
+        removed = [] if state is None else [month for month in state["partitions"] if month not in partitions]
+
+        if state is not None and not changed and not removed:
+            return []
+
+        pieces = {summary: [] for summary in SUMMARIES}
+        datasets, dataset_names = compact_datasets(datasets), compact_dataset_names(dataset_names)
+        for month in changed:
+            requests = compact_requests(read_snapshot_files(snapshot_directory, partitions[month]))
+            for summary, frame in summarise_requests(BaseData(requests, datasets, dataset_names)).items():
+                pieces[summary].append(frame)
+
+        months = sorted(changed + removed)
+        refreshed_months = pd.PeriodIndex(months, freq='M')
+        empty = summarise_requests(BaseData(compact_requests(normalise_types(pd.DataFrame(columns=SNAPSHOT_COLUMNS))),
+                                            datasets, dataset_names))
+        for summary in SUMMARIES:
+            if state is not None:
+                existing = pd.read_parquet(summary_path(summary_directory, summary))
+                pieces[summary].insert(0, existing.loc[~summary_months(existing).isin(refreshed_months)])
+            frame = pd.concat(pieces[summary], ignore_index=True) if pieces[summary] else empty[summary]
+            # months summarised on different runs carry different dictionaries, concat falls back to strings
+            frame = frame.astype({column: 'category' for column in ('data_category', 'security') if column in frame})
+
+            path = summary_path(summary_directory, summary)
+            frame.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+
+        # written last, readers key their caches on it so they never pick up a half written set
+        high_water_mark = read_high_water_mark(snapshot_directory)
+        write_summary_state(summary_directory, {"format": SUMMARY_FORMAT,
+                                                "high_water_mark": high_water_mark["id"] if high_water_mark else 0,
+                                                "datasets_hash": datasets_hash, "partitions": partitions})
+
+        return months
+
+
+@profiled("summaries.read")
+def read_summary(summary: str, summary_directory: str = request_summary_directory) -> pd.DataFrame:
+    return pd.read_parquet(summary_path(summary_directory, summary), memory_map=True)
+
+
+def read_summaries(summary_directory: str = request_summary_directory) -> Dict[str, pd.DataFrame]:
+    return {summary: read_summary(summary, summary_directory) for summary in SUMMARIES}
+
+
+def run_refresher(interval_seconds: float = summary_refresh_interval_seconds,
+                  engine: Union[sql.engine.Engine, None] = None,
+                  snapshot_directory: str = request_snapshot_directory,
+                  summary_directory: str = request_summary_directory,
+                  stop: Union[threading.Event, None] = None):
+    # a failed run is logged and retried on the next tick, the last good summaries stay in place meanwhile
+    stop = stop if stop is not None else threading.Event()
+    while not stop.is_set():
+        try:
+            months = refresh_summaries(engine, snapshot_directory, summary_directory)
+            if months:
+                logger.info("summarised %s", ", ".join(months))
+        except Exception:
+            logger.exception("summary refresh failed")
+        stop.wait(interval_seconds)
+
+
+def start_background_refresher(interval_seconds: float = summary_refresh_interval_seconds) -> threading.Thread:
+    # one refresher per process, streamlit reruns the script on every interaction but keeps imported modules
+    global _refresher_thread
+    with _refresher_lock:
+        if _refresher_thread is None or not _refresher_thread.is_alive():
+            _refresher_thread = threading.Thread(target=run_refresher, args=(interval_seconds,),
+                                                 name="summary-refresher", daemon=True)
+            _refresher_thread.start()
+    return _refresher_thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Keep the dashboard's request summaries up to date")
+    parser.add_argument("--interval", type=float, default=summary_refresh_interval_seconds,
+                        help="seconds between refreshes")
+    parser.add_argument("--once", action="store_true", help="refresh once and exit")
+    parser.add_argument("--rebuild", action="store_true", help="summarise every month again before starting")
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if arguments.once or arguments.rebuild:
+        print(", ".join(refresh_summaries(rebuild=arguments.rebuild)) or "summaries already up to date")
+    if not arguments.once:
+        run_refresher(arguments.interval)
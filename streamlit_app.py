@@ -1,12 +1,24 @@
 from format_table import format_values_in_fee_table, format_values_in_count_table
-from dataset_breakdown import connect_to_dataset
-from access_fees import return_access_fees
-from unique_fees import return_unique_fees
-from requests_plot import request_chart
+from dataset_breakdown import compute_dataset_breakdown
+from access_fees import return_access_fees, build_daily_accesses
+from unique_fees import return_unique_fees, build_security_counter, calculate_security_counter, calculate_band_headroom
+from requests_plot import request_chart, count_requests_by_day
+from data_loader import load_base_data, load_dataset_tables, data_version, compact_datasets, compact_dataset_names
+from fee_scenarios import build_fee_baseline, evaluate_fee_scenarios
+from fee_cache import get_or_build, optional_file_hash, cache_statistics, clear
+from profiling import start_run, stage, last_run
+from request_summaries import start_background_refresher, refresh_summaries, read_summary, summary_version
+from concurrent_loader import load_concurrently, run_once
+from billing_history import read_billing_history, read_opening_balances, OPENING_BALANCES_PATH, BILLING_HISTORY_PATH
+from fee_schedule import load_fee_schedules, schedule_in_effect, fee_schedule_version
+from creds import access_aggregation_mode, profiling_enabled, request_snapshot_directory, \
+    request_summary_directory, summary_refresher_mode, band_alert_horizon_days
 import streamlit as st
 import pandas as pd
+import datetime
 
 if __name__ == '__main__':
+    start_run()
     default_unique_dict = {"Derived": 0, "Pricing": 0, "Security Master": 0}
     default_fee_modifier = [{"Data Category": "Derived", "Number of Securities": 0, "Frequency per Day": 0}]
 
@@ -21,68 +33,234 @@ if __name__ == '__main__':
                                      "Frequency per Day": int(frequency_1)}]
             default_unique_dict[data_category_1] += number_of_securities_1
 
-    unique_fee_table, unique_fee_table_sec_counter, total_unique_fee, additional_unique_fees = return_unique_fees(
-        default_unique_dict)
-    access_fee_table, total_access_fee, additional_access_fee = return_access_fees(default_fee_modifier)
+    # summaries need the snapshot to summarise, without either the tables are built from raw rows
+    use_summaries = bool(request_summary_directory and request_snapshot_directory)
+    # an external refresher owns the snapshot and the summaries, the app only reads what it has written
+    refreshes_in_app = not use_summaries or summary_refresher_mode == "thread"
+    if use_summaries and refreshes_in_app:
+        start_background_refresher()
 
-    col1, col2, col3 = st.columns(3)
+    if st.sidebar.button("Refresh data"):
+        if use_summaries and refreshes_in_app:
+            refresh_summaries()
+        clear()
 
-    with col1:
-        st.write("<h5>Total Bloomberg Data License Fees</h5>", unsafe_allow_html=True)
-        all_fees = total_access_fee + total_unique_fee
-        if additional_access_fee or additional_unique_fees:
-            st.write(f"${all_fees + additional_unique_fees + additional_access_fee:,.2f}")
-            st.write(f"Additional Costs: ${additional_access_fee + additional_unique_fees:,.2f}")
-        else:
-            st.write(f"${all_fees:,.2f}")
+    # the opening balances and closed months are folded into the cached security counter, so a change to either
+    # rebuilds it too
+    reference_files_hash = (fee_schedule_version(), optional_file_hash(OPENING_BALANCES_PATH),
+                            optional_file_hash(BILLING_HISTORY_PATH))
+    summaries_built_to = summary_version() if use_summaries else None
+    if summaries_built_to is not None:
+        # the refresher keeps the aggregates current, so a page load never touches the requests table
+        cache_key = ("summaries", summaries_built_to, reference_files_hash)
 
-    with col2:
-        st.write("<h5>Total Accrued Access Fees</h5>", unsafe_allow_html=True)
-        if additional_access_fee:
-            st.write(f"${total_access_fee + additional_access_fee:,.2f}")
-            st.write(f"Additional Costs: ${additional_access_fee:,.2f}")
-        else:
-            st.write(f"${total_access_fee:,.2f}")
+        def build_security_counter_from_source():
+            return calculate_security_counter(read_summary("category_month_securities"), read_opening_balances(),
+                                              read_billing_history())
 
-    with col3:
-        st.write("<h5>Total Accrued Unique Fees</h5>", unsafe_allow_html=True)
-        if additional_unique_fees:
-            st.write(f"${total_unique_fee + additional_unique_fees:,.2f}")
-            st.write(f"Additional Costs: ${additional_unique_fees:,.2f}")
-        else:
-            st.write(f"${total_unique_fee:,.2f}")
+        def build_daily_accesses_from_source():
+            return read_summary("daily_accesses")
 
-    st.write("Unique Fees")
-    st.table(unique_fee_table)
+        def count_requests_from_source():
+            return read_summary("request_counts")
 
-    st.write("Access Fees")
-    st.table(access_fee_table)
+        def build_dataset_breakdown_from_source():
+            datasets, dataset_names = load_dataset_tables()
+            return compute_dataset_breakdown(compact_datasets(datasets), compact_dataset_names(dataset_names),
+                                             read_summary("requested_datasets")['dataset_id'])
+    else:
+        # the base tables are only rebuilt when new requests land, the band sheet changes or the ttl runs out,
+        # so a what-if submission only re-runs the modifier step
+        # until an external refresher has written the first summaries the rows come straight from the database,
+        # leaving its snapshot alone
+        snapshot_directory = request_snapshot_directory if refreshes_in_app else ""
+        cache_key = (data_version(snapshot_directory=snapshot_directory), reference_files_hash)
+        # pull the raw tables at most once per run and share them between every pipeline that misses the cache
+        base_data = run_once(lambda: load_base_data(snapshot_directory=snapshot_directory))
 
-    st.write("Distinct Number of Securities by Data Category and Month")
-    st.table(unique_fee_table_sec_counter)
+        def build_security_counter_from_source():
+            return build_security_counter(base_data())
 
+        def build_daily_accesses_from_source():
+            return build_daily_accesses(base_data() if access_aggregation_mode == "memory" else None)
 
-    def concatenate_bounds(row):
-        return f"{row['Lower Bound']} - {row['Upper Bound']}"
+        def count_requests_from_source():
+            return count_requests_by_day(base_data())
 
+        def build_dataset_breakdown_from_source():
+            return compute_dataset_breakdown(base_data().datasets, base_data().dataset_names,
+                                             base_data().requests['dataset_id'])
 
-    fee_table = pd.read_csv("unique_fee_reference_sheet.csv")
+    def load_unique_fees():
+        security_counter = get_or_build("security_counter", cache_key, build_security_counter_from_source)
+        return security_counter, return_unique_fees(default_unique_dict, security_counter=security_counter)
+
+    def load_access_fees():
+        daily_accesses = get_or_build("daily_accesses", cache_key, build_daily_accesses_from_source)
+        return daily_accesses, return_access_fees(default_fee_modifier, daily_accesses=daily_accesses)
+
+    def load_request_counts():
+        return get_or_build("request_counts", cache_key, count_requests_from_source)
+
+    def load_dataset_breakdown():
+        return get_or_build("dataset_breakdown", cache_key, build_dataset_breakdown_from_source)
+
+    # placeholders hold each section's spot on the page so sections can fill in as their data arrives
+    totals_section = st.empty()
+    scenarios_section = st.empty()
+    unique_fees_section = st.empty()
+    access_fees_section = st.empty()
+    security_counts_section = st.empty()
+
+    # the bands shown are the ones this month is being priced under
+    fee_table = schedule_in_effect(load_fee_schedules(), datetime.date.today()).band_table
     fee_table = fee_table.loc[fee_table['Data Category'] != 'Historical'].copy()
     fee_table['Monthly Cost'] = fee_table['Price per annum'] / 12
-    fee_table['Band'] = fee_table.apply(concatenate_bounds, axis=1)
+    fee_table['Band'] = fee_table['Lower Bound'].astype(str) + " - " + fee_table['Upper Bound'].astype(str)
 
     fee_table = fee_table.drop(columns=['Price per annum', 'Lower Bound'])
     fee_table = pd.pivot_table(fee_table, values='Monthly Cost', index=['Band', 'Upper Bound'],
                                columns='Data Category').reset_index().rename_axis(None, axis=1)
-    fee_table = fee_table.sort_values(by=['Upper Bound']).drop(columns=['Upper Bound']).reset_index(drop=True)
+    fee_table = fee_table.sort_values(by=['Upper Bound']).drop(columns=['Upper Bound']).set_index("Band")
+
+    st.write("Bloomberg Bands")
+    st.dataframe(format_values_in_fee_table(fee_table))
+    band_alerts_section = st.empty()
 
-    for column in ['Derived', 'Pricing', 'Security Master']:
-        fee_table[column] = fee_table[column].apply(lambda x: "${:,.2f}".format(x))
+    chart_section = st.empty()
+    breakdown_section = st.empty()
 
-    fee_table = fee_table.set_index("Band")
+    loaded = {}
+    # widgets and elements are only ever created here on the script thread, the loader threads just compute
+    for section, result in load_concurrently({"unique_fees": load_unique_fees, "access_fees": load_access_fees,
+                                              "request_counts": load_request_counts,
+                                              "dataset_breakdown": load_dataset_breakdown}):
+        loaded[section] = result
 
-    st.write("Bloomberg Bands")
-    st.table(fee_table)
+        if section == "unique_fees":
+            unique_fee_table, unique_fee_table_sec_counter, total_unique_fee, additional_unique_fees, \
+                additional_unique_fee_table, additional_unique_fee_table_sec_counter = result[1]
+
+            with unique_fees_section.container():
+                st.write("Unique Fees")
+                st.dataframe(format_values_in_fee_table(unique_fee_table))
+                if additional_unique_fees:
+                    st.write("Additional Unique Fees")
+                    st.dataframe(format_values_in_fee_table(additional_unique_fee_table))
+
+            with security_counts_section.container():
+                st.write("Distinct Number of Securities by Data Category and Month")
+                st.dataframe(format_values_in_count_table(unique_fee_table_sec_counter))
+                if additional_unique_fee_table_sec_counter.to_numpy().any():
+                    st.write("Additional Securities")
+                    st.dataframe(format_values_in_count_table(additional_unique_fee_table_sec_counter))
+
+            # cheap enough to work out on every render, so it always follows the cached counter and the current bands
+            band_headroom = calculate_band_headroom(result[0], load_fee_schedules(), datetime.date.today())
+            latest_month = band_headroom['timestamp'].max()
+            band_alerts = band_headroom.loc[band_headroom['timestamp'] == latest_month].sort_values(
+                by=['projected_crossing', 'headroom'])
+
+            with band_alerts_section.container():
+                st.write("Band Alerts")
+                # looking ahead from the day the latest counts were reached, not the start of their month
+                alert_horizon = band_alerts['counted_to'].max() + pd.Timedelta(days=band_alert_horizon_days)
+                for alert in band_alerts.loc[band_alerts['projected_crossing'] <= alert_horizon].itertuples():
+                    st.warning(f"{alert.data_category} is projected to pass {alert.band_upper_bound:,.0f} securities "
+                               f"on {alert.projected_crossing:%Y-%m-%d}, adding "
+                               f"${alert.monthly_fee_increase:,.2f} a month")
+                st.dataframe(band_alerts, hide_index=True, column_config={
+                    'counted_to': st.column_config.DateColumn(),
+                    'daily_growth': st.column_config.NumberColumn(format="%.1f"),
+                    'projected_crossing': st.column_config.DateColumn(),
+                    'monthly_fee_increase': st.column_config.NumberColumn(format="$%.2f")})
+
+        elif section == "access_fees":
+            access_fee_table, total_access_fee, additional_access_fee, additional_access_fee_table = result[1]
+
+            with access_fees_section.container():
+                st.write("Access Fees")
+                st.dataframe(format_values_in_fee_table(access_fee_table))
+                if additional_access_fee:
+                    st.write("Projected Additional Access Fees to Month End")
+                    st.dataframe(format_values_in_fee_table(additional_access_fee_table))
+
+        elif section == "request_counts":
+            request_counts = result
+
+            with chart_section.container():
+                st.write("Requests by day and dataset")
+                if request_counts.empty:
+                    chart_range = ()
+                else:
+                    first_day, last_day = min(request_counts['timestamp']), max(request_counts['timestamp'])
+                    chart_range = st.date_input("Date range", value=(first_day, last_day), min_value=first_day,
+                                                max_value=last_day, key="chart_range")
+                # the picker hands back a single date while a range is half selected
+                request_figure = request_chart(request_counts=request_counts,
+                                               date_from=chart_range[0] if chart_range else None,
+                                               date_to=chart_range[1] if len(chart_range) > 1 else None)
+                with stage("render.chart", len(request_counts)):
+                    st.plotly_chart(request_figure)
+
+        elif section == "dataset_breakdown":
+            with breakdown_section.container():
+                st.write("Dataset Breakdown")
+                st.dataframe(result)
+
+        # the totals and scenarios need both fee pipelines, so they fill in once the second one lands
+        if section in ("unique_fees", "access_fees") and {"unique_fees", "access_fees"} <= loaded.keys():
+            security_counter, daily_accesses = loaded["unique_fees"][0], loaded["access_fees"][0]
+
+            with totals_section.container():
+                col1, col2, col3 = st.columns(3)
+
+                with col1:
+                    st.write("<h5>Total Bloomberg Data License Fees</h5>", unsafe_allow_html=True)
+                    all_fees = total_access_fee + total_unique_fee
+                    if additional_access_fee or additional_unique_fees:
+                        st.write(f"${all_fees + additional_unique_fees + additional_access_fee:,.2f}")
+                        st.write(f"Additional Costs: ${additional_access_fee + additional_unique_fees:,.2f}")
+                    else:
+                        st.write(f"${all_fees:,.2f}")
+
+                with col2:
+                    st.write("<h5>Total Accrued Access Fees</h5>", unsafe_allow_html=True)
+                    if additional_access_fee:
+                        st.write(f"${total_access_fee + additional_access_fee:,.2f}")
+                        st.write(f"Additional Costs: ${additional_access_fee:,.2f}")
+                    else:
+                        st.write(f"${total_access_fee:,.2f}")
+
+                with col3:
+                    st.write("<h5>Total Accrued Unique Fees</h5>", unsafe_allow_html=True)
+                    if additional_unique_fees:
+                        st.write(f"${total_unique_fee + additional_unique_fees:,.2f}")
+                        st.write(f"Additional Costs: ${additional_unique_fees:,.2f}")
+                    else:
+                        st.write(f"${total_unique_fee:,.2f}")
+
+            # every scenario is priced as a delta against one shared baseline, so the table stays cheap to edit
+            with scenarios_section.container():
+                st.write("What-if Scenarios")
+                scenario_input = st.data_editor(
+                    pd.DataFrame([{"Scenario": "Scenario 1", "Data Category": "Derived", "Number of Securities": 0,
+                                   "Frequency per Day": 0}]),
+                    num_rows="dynamic", key="scenarios",
+                    column_config={"Data Category": st.column_config.SelectboxColumn(
+                        options=list(default_unique_dict.keys()), required=True)})
+                try:
+                    scenario_results = evaluate_fee_scenarios(build_fee_baseline(security_counter, daily_accesses),
+                                                              scenario_input.dropna(subset=['Data Category']))
+                    st.dataframe(scenario_results, hide_index=True, column_config={
+                        column: st.column_config.NumberColumn(format="$%.2f")
+                        for column in ['unique_fee_delta', 'access_fee_delta', 'total_fee_delta']})
+                except ValueError as error:
+                    st.error(str(error))
+
+    with st.sidebar.expander("Cache"):
+        st.dataframe(cache_statistics())
 
-    st.write("Requests by day and dataset")
-    st.plotly_chart(request_chart())
+    if profiling_enabled:
+        with st.expander("Performance"):
+            st.dataframe(last_run(), hide_index=True)
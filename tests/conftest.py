@@ -0,0 +1,27 @@
+import os
+import sys
+
+# the modules sit flat at the top of the repo and read their reference sheets relative to it
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmark import generate_synthetic_database
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def run_from_repo_root(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+
+
+@pytest.fixture(scope="session")
+def synthetic_engine(tmp_path_factory):
+    # a small sqlite stand-in with the mysql schema, shared by every test that only reads it
+    return generate_synthetic_database(str(tmp_path_factory.mktemp("database") / "requests.db"), 20_000, 500, 100, 40,
+                                       150)
+
+
+@pytest.fixture
+def writable_engine(tmp_path):
+    # its own copy for tests that add or remove requests
+    return generate_synthetic_database(str(tmp_path / "requests.db"), 5_000, 200, 50, 20, 90)
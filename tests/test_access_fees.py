@@ -0,0 +1,107 @@
+from access_fees import calculate_number_of_new_accesses_per_day, query_number_of_new_accesses_per_day, \
+    project_month_end_access_fees, return_access_fees, build_daily_accesses, open_date_ranges
+from billing_history import read_billing_history, closed_access_fees, BILLING_HISTORY_COLUMNS
+from fee_schedule import load_fee_schedules
+from data_loader import load_base_data
+import pandas as pd
+import tracemalloc
+import datetime
+import pytest
+
+
+def comparable(accesses: pd.DataFrame) -> pd.DataFrame:
+    accesses = accesses.astype({'data_category': str, 'security': str, 'id': 'int64'})
+    return accesses[['data_category', 'security', 'timestamp', 'id']].sort_values(
+        by=['data_category', 'security', 'timestamp']).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("date_from, date_to", [(None, None), (datetime.date(2023, 2, 1), None),
+                                                (None, datetime.date(2023, 4, 15)),
+                                                (datetime.date(2023, 2, 10), datetime.date(2023, 3, 20))])
+def test_memory_and_pushdown_aggregation_match(synthetic_engine, date_from, date_to):
+    base_data = load_base_data(synthetic_engine, snapshot_directory=None, streaming=False)
+
+    in_memory = calculate_number_of_new_accesses_per_day(base_data.datasets,
+                                                         base_data.requests[['timestamp', 'dataset_id']],
+                                                         date_from, date_to)
+    pushed_down = query_number_of_new_accesses_per_day(synthetic_engine, date_from, date_to)
+
+    assert len(in_memory) > 0
+    pd.testing.assert_frame_equal(comparable(in_memory), comparable(pushed_down))
+
+
+def test_open_date_ranges_run_between_closed_months():
+    closed = pd.DatetimeIndex(["2023-03-01", "2023-01-01", "2023-02-01", "2023-05-01"])
+    assert open_date_ranges(closed) == [(None, datetime.date(2023, 1, 1)),
+                                        (datetime.date(2023, 4, 1), datetime.date(2023, 5, 1)),
+                                        (datetime.date(2023, 6, 1), None)]
+    assert open_date_ranges(pd.DatetimeIndex([])) == [(None, None)]
+
+
+@pytest.mark.parametrize("aggregation_mode", ["memory", "pushdown"])
+def test_closed_months_are_left_out_before_counting(synthetic_engine, aggregation_mode):
+    base_data = load_base_data(synthetic_engine, snapshot_directory=None, streaming=False)
+    billing_history = pd.DataFrame({"Fee Type": "access", "Data Category": "Pricing",
+                                    "Month": pd.to_datetime(["2023-01-01", "2023-03-01"]), "Fee": 1.0},
+                                   columns=BILLING_HISTORY_COLUMNS)
+
+    daily_accesses = build_daily_accesses(base_data, aggregation_mode, synthetic_engine, billing_history)
+    everything = calculate_number_of_new_accesses_per_day(base_data.datasets,
+                                                          base_data.requests[['timestamp', 'dataset_id']])
+    expected = everything.loc[~everything['timestamp'].dt.month.isin([1, 3])]
+
+    assert daily_accesses['timestamp'].dt.month.isin([2, 4, 5]).all() and len(daily_accesses) > 0
+    pd.testing.assert_frame_equal(comparable(daily_accesses), comparable(expected))
+
+
+def last_days_accesses() -> pd.DataFrame:
+    # wednesday the 29th leaves thursday and friday as the business days still to come in march 2023
+    return pd.DataFrame({'data_category': ['Pricing', 'Derived', 'Pricing'],
+                         'security': ['A', 'B', 'A'],
+                         'timestamp': pd.to_datetime(['2023-03-28', '2023-03-29', '2023-03-29']),
+                         'id': [7, 3, 5]})
+
+
+def test_month_end_projection_by_hand():
+    projected = project_month_end_access_fees(
+        last_days_accesses(), [{"Data Category": "Derived", "Number of Securities": 100, "Frequency per Day": 2}],
+        load_fee_schedules()).set_index('data_category')
+
+    # pricing: 5 accesses a day at 0.01 for 2 days, derived: 3 plus 100 securities twice a day at 0.03 for 2 days
+    assert projected.loc['Pricing', 'fee'] == pytest.approx(5 * 0.01 * 2)
+    assert projected.loc['Derived', 'fee'] == pytest.approx((3 + 100 * 2) * 0.03 * 2)
+    assert set(projected['timestamp']) == {"2023-03-01"}
+
+
+def test_month_end_projection_stays_flat_as_securities_grow():
+    fee_schedules = load_fee_schedules()
+    peaks = {}
+    for number_of_securities in (10, 50_000, 10_000_000):
+        modifier = [{"Data Category": "Pricing", "Number of Securities": number_of_securities, "Frequency per Day": 4}]
+        tracemalloc.start()
+        projected = project_month_end_access_fees(last_days_accesses(), modifier, fee_schedules)
+        peaks[number_of_securities] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        assert projected.set_index('data_category').loc['Pricing', 'fee'] == \
+            pytest.approx((5 + number_of_securities * 4) * 0.01 * 2)
+
+    # the modifier is priced as a count, never expanded into a row per security
+    assert peaks[10_000_000] < 2 * peaks[10] + 64 * 1024, peaks
+
+
+@pytest.mark.parametrize("daily_accesses", [
+    pd.DataFrame({'data_category': pd.Series(dtype=str), 'security': pd.Series(dtype=str),
+                  'timestamp': pd.Series(dtype='datetime64[ns]'), 'id': pd.Series(dtype='int64')}),
+    # only accesses from a month the billing history has closed
+    pd.DataFrame({'data_category': ['Pricing'], 'security': ['A'], 'timestamp': pd.to_datetime(['2022-12-05']),
+                  'id': [3]})])
+def test_no_open_accesses_leaves_only_the_closed_fees(daily_accesses):
+    modifier = [{"Data Category": "Derived", "Number of Securities": 5, "Frequency per Day": 1}]
+    access_fee_table, accrued, projected, projected_table = return_access_fees(modifier, daily_accesses=daily_accesses)
+
+    closed = closed_access_fees(read_billing_history())
+    assert accrued == pytest.approx(closed['fee'].sum())
+    assert projected == 0
+    assert access_fee_table.sum().sum() == pytest.approx(closed['fee'].sum())
+    assert not projected_table.to_numpy().any()
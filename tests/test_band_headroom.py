@@ -0,0 +1,39 @@
+from unique_fees import calculate_band_headroom
+from fee_schedule import load_fee_schedules
+import pandas as pd
+import datetime
+import pytest
+
+
+@pytest.fixture
+def security_counter():
+    # derived sits in the 501 to 1000 band, one month of history would be too short to show growth
+    return pd.DataFrame({'data_category': ['Derived', 'Derived', 'Derived'],
+                         'timestamp': [datetime.date(2023, 1, 1), datetime.date(2023, 2, 1), datetime.date(2023, 3, 1)],
+                         'number_of_cumulative_securities': [900, 957, 1000]})
+
+
+def test_mid_month_projection_starts_from_the_day_the_count_was_reached(security_counter):
+    headroom = calculate_band_headroom(security_counter, load_fee_schedules(), datetime.date(2023, 3, 15))
+    march = headroom.iloc[-1]
+
+    # january's count stands at the 31st and march's at the 15th, 43 days apart, for 100 more securities
+    assert march['counted_to'] == pd.Timestamp("2023-03-15")
+    assert march['headroom'] == 0
+    assert march['daily_growth'] == pytest.approx(100 / 43)
+    # one more security tips it into the next band, a day at that rate
+    assert march['projected_crossing'] == pd.Timestamp("2023-03-16")
+    assert march['monthly_fee_increase'] == pytest.approx((8030 - 3210) / 12)
+
+    # february has finished, so its count runs to the 28th. 57 securities over 28 days leaves 43 to go
+    february = headroom.iloc[1]
+    assert february['counted_to'] == pd.Timestamp("2023-02-28")
+    assert february['daily_growth'] == pytest.approx(57 / 28)
+    assert february['projected_crossing'] == pd.Timestamp("2023-02-28") + pd.Timedelta(days=22)
+
+
+def test_closed_months_are_not_projected_from_a_later_day(security_counter):
+    headroom = calculate_band_headroom(security_counter, load_fee_schedules(), datetime.date(2023, 9, 1))
+    assert list(headroom['counted_to']) == list(pd.to_datetime(["2023-01-31", "2023-02-28", "2023-03-31"]))
+    # a category's first month has nothing earlier to measure growth against
+    assert pd.isna(headroom.iloc[0]['projected_crossing'])
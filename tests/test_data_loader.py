@@ -0,0 +1,74 @@
+from data_loader import BaseData, load_base_data, load_dataset_tables, stream_requests, fold_request_days, \
+    compact_requests, compact_datasets, compact_dataset_names, REQUESTS_QUERY
+from benchmark import generate_synthetic_database
+from sqlalchemy import text
+from unique_fees import build_security_counter
+from access_fees import build_daily_accesses
+from requests_plot import count_requests_by_day
+import pandas as pd
+import tracemalloc
+import pytest
+
+# far below the synthetic table, so the fold has to carry its counts across many chunks
+CHUNK_SIZE = 700
+
+
+@pytest.fixture(scope="module")
+def full_and_streamed(synthetic_engine):
+    full = load_base_data(synthetic_engine, "", False)
+
+    chunks = list(stream_requests(synthetic_engine, CHUNK_SIZE))
+    datasets, dataset_names = load_dataset_tables(synthetic_engine)
+    streamed = BaseData(requests=compact_requests(fold_request_days(chunks)), datasets=compact_datasets(datasets),
+                        dataset_names=compact_dataset_names(dataset_names))
+
+    assert len(chunks) > 20 and max(len(chunk) for chunk in chunks) <= CHUNK_SIZE
+    return full, streamed
+
+
+def test_folded_frame_is_smaller_but_counts_every_request(full_and_streamed):
+    full, streamed = full_and_streamed
+    assert len(streamed.requests) < len(full.requests)
+    assert streamed.requests['requests'].sum() == len(full.requests)
+
+
+def test_streamed_security_counter_matches_the_full_read(full_and_streamed):
+    full, streamed = full_and_streamed
+    pd.testing.assert_frame_equal(build_security_counter(streamed), build_security_counter(full))
+
+
+def test_streamed_daily_accesses_match_the_full_read(full_and_streamed):
+    full, streamed = full_and_streamed
+    pd.testing.assert_frame_equal(build_daily_accesses(streamed, "memory"), build_daily_accesses(full, "memory"))
+
+
+def test_streamed_chart_counts_match_the_full_read(full_and_streamed):
+    full, streamed = full_and_streamed
+    streamed_counts, full_counts = count_requests_by_day(streamed), count_requests_by_day(full)
+    key = list(full_counts.columns)
+    pd.testing.assert_frame_equal(streamed_counts.sort_values(by=key).reset_index(drop=True),
+                                  full_counts.sort_values(by=key).reset_index(drop=True), check_dtype=False)
+
+
+def traced_peak_mb(function) -> (object, float):
+    tracemalloc.start()
+    try:
+        result = function()
+        return result, tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def test_streaming_holds_a_chunk_rather_than_the_table(tmp_path):
+    # many requests on few dataset days, the shape a long busy history has, so the table dwarfs what it folds to
+    engine = generate_synthetic_database(str(tmp_path / "busy.db"), 100_000, 100, 20, 10, 30)
+
+    def read_everything():
+        with engine.connect() as conn:
+            return pd.read_sql(text(REQUESTS_QUERY), conn, parse_dates=['timestamp'])
+
+    full, full_peak_mb = traced_peak_mb(read_everything)
+    folded, folded_peak_mb = traced_peak_mb(lambda: fold_request_days(stream_requests(engine, 2_000)))
+
+    assert folded['requests'].sum() == len(full)
+    assert folded_peak_mb < full_peak_mb / 10
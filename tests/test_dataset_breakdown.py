@@ -0,0 +1,27 @@
+from dataset_breakdown import connect_to_dataset, compute_dataset_breakdown
+from data_loader import load_base_data
+from sqlalchemy import text
+import pandas as pd
+
+
+def assert_breakdown_matches_the_sql(engine):
+    base_data = load_base_data(engine, "", False)
+
+    expected = connect_to_dataset(engine).sort_index()
+    actual = compute_dataset_breakdown(base_data.datasets, base_data.dataset_names,
+                                       base_data.requests['dataset_id']).sort_index()
+
+    assert 'bidask' in expected.index and len(expected) > 1
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_breakdown_from_frames_matches_the_sql(synthetic_engine):
+    assert_breakdown_matches_the_sql(synthetic_engine)
+
+
+def test_datasets_never_requested_are_left_out(writable_engine):
+    # the first few datasets of either name lose their requests, so the named row and the counts both move
+    with writable_engine.begin() as conn:
+        conn.execute(text("DELETE FROM requests WHERE dataset_id <= 12"))
+
+    assert_breakdown_matches_the_sql(writable_engine)
@@ -0,0 +1,86 @@
+from fee_cache import get_or_build, clear, cache_statistics, file_hash, optional_file_hash
+import fee_cache
+import types
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # one fake clock for the ttl and the build timings, and an empty cache each test
+    clock = Clock()
+    monkeypatch.setattr(fee_cache, "time", types.SimpleNamespace(monotonic=clock, perf_counter=clock))
+    monkeypatch.setattr(fee_cache, "_entries", {})
+    monkeypatch.setattr(fee_cache, "_statistics", {})
+    return clock
+
+
+def counting_builder(clock, seconds: float = 0.0):
+    builds = []
+
+    def build():
+        builds.append(1)
+        clock.now += seconds
+        return len(builds)
+
+    return build, builds
+
+
+def test_hits_until_the_ttl_runs_out(clock):
+    build, builds = counting_builder(clock)
+    assert get_or_build("counter", "key", build, ttl_seconds=60) == 1
+
+    clock.now += 59
+    assert get_or_build("counter", "key", build, ttl_seconds=60) == 1
+    clock.now += 1
+    assert get_or_build("counter", "key", build, ttl_seconds=60) == 2
+    assert len(builds) == 2
+
+
+def test_a_new_key_rebuilds_and_entries_are_independent(clock):
+    build, builds = counting_builder(clock)
+    other, other_builds = counting_builder(clock)
+
+    assert get_or_build("counter", ("data", 1), build) == 1
+    assert get_or_build("accesses", ("data", 1), other) == 1
+    assert get_or_build("counter", ("data", 2), build) == 2
+    assert get_or_build("accesses", ("data", 1), other) == 1
+    assert (len(builds), len(other_builds)) == (2, 1)
+
+
+def test_clear_drops_every_entry_but_keeps_the_statistics(clock):
+    build, builds = counting_builder(clock)
+    get_or_build("counter", "key", build)
+    clear()
+
+    assert get_or_build("counter", "key", build) == 2
+    assert cache_statistics().loc["counter", "misses"] == 2
+
+
+def test_statistics_count_hits_misses_and_build_time(clock):
+    build, _ = counting_builder(clock, seconds=2.5)
+    get_or_build("counter", "key", build)
+    get_or_build("counter", "key", build)
+    get_or_build("counter", "key", build)
+    get_or_build("counter", "new key", counting_builder(clock, seconds=0.5)[0])
+
+    statistics = cache_statistics().loc["counter"]
+    assert (statistics["hits"], statistics["misses"]) == (2, 2)
+    assert statistics["last_build_seconds"] == pytest.approx(0.5)
+    assert statistics["total_build_seconds"] == pytest.approx(3.0)
+    assert statistics["key"] == "new key"
+
+
+def test_a_missing_reference_file_hashes_to_none(tmp_path):
+    path = tmp_path / "opening_balances.csv"
+    assert optional_file_hash(str(path)) is None
+
+    path.write_text("Data Category,Number of Securities,Valid From,Valid Until\n")
+    assert optional_file_hash(str(path)) == file_hash(str(path))
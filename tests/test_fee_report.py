@@ -0,0 +1,50 @@
+from fee_report import run_fee_report
+from fee_scenarios import scenarios_to_frame
+from unique_fees import build_security_counter
+from access_fees import build_daily_accesses
+from billing_history import read_billing_history
+from data_loader import load_base_data
+import pandas as pd
+import pytest
+
+SCENARIOS = scenarios_to_frame([{"Scenario": "more pricing", "Data Category": "Pricing", "Number of Securities": 10,
+                                 "Frequency per Day": 2}])
+
+
+@pytest.fixture(scope="module")
+def fee_inputs(synthetic_engine):
+    base_data = load_base_data(synthetic_engine, "", False)
+    return build_security_counter(base_data, read_billing_history()), build_daily_accesses(base_data, "memory")
+
+
+def closed_in_april(billing_history: pd.DataFrame) -> pd.DataFrame:
+    # an invoice from after the period being reported on, far too large to go unnoticed in its totals
+    april = pd.DataFrame({"Fee Type": ["unique", "access"], "Data Category": "Pricing",
+                          "Month": pd.Timestamp("2023-04-01"), "Number of Securities": [1, None],
+                          "Fee": [100_000.0, 100_000.0]})
+    return pd.concat([billing_history, april], ignore_index=True)
+
+
+def test_an_earlier_period_leaves_out_months_closed_after_it(fee_inputs):
+    security_counter, daily_accesses = fee_inputs
+    february = [pd.Period("2023-02", freq="M")]
+
+    before = run_fee_report(security_counter, daily_accesses, SCENARIOS, february,
+                            billing_history=read_billing_history())
+    after = run_fee_report(security_counter, daily_accesses, SCENARIOS, february,
+                           billing_history=closed_in_april(read_billing_history()))
+
+    pd.testing.assert_frame_equal(after, before)
+
+
+def test_a_later_period_includes_the_closed_month(fee_inputs):
+    security_counter, daily_accesses = fee_inputs
+    may = [pd.Period("2023-05", freq="M")]
+
+    before = run_fee_report(security_counter, daily_accesses, SCENARIOS, may, billing_history=read_billing_history())
+    after = run_fee_report(security_counter, daily_accesses, SCENARIOS, may,
+                           billing_history=closed_in_april(read_billing_history()))
+
+    # april's pricing is replaced by the invoice, so the totals move by the invoice less what april had accrued
+    assert after['accrued_unique_fees'].iloc[0] > before['accrued_unique_fees'].iloc[0] + 90_000
+    assert after['accrued_access_fees'].iloc[0] > before['accrued_access_fees'].iloc[0] + 90_000
@@ -0,0 +1,61 @@
+from fee_scenarios import build_fee_baseline, evaluate_fee_scenarios, scenarios_to_frame
+from unique_fees import build_security_counter, return_unique_fees
+from access_fees import build_daily_accesses, return_access_fees
+from data_loader import load_base_data
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def fee_inputs(synthetic_engine):
+    base_data = load_base_data(synthetic_engine, "", False)
+    security_counter, daily_accesses = build_security_counter(base_data), build_daily_accesses(base_data, "memory")
+    return security_counter, daily_accesses, build_fee_baseline(security_counter, daily_accesses)
+
+
+def priced_one_at_a_time(security_counter, daily_accesses, scenario: dict) -> (float, float):
+    # what the dashboard's modifiers add for the same scenario, access fees net of the plain forward fill
+    unique_fee_delta = return_unique_fees({scenario["Data Category"]: scenario["Number of Securities"]},
+                                          security_counter=security_counter)[3]
+    access_fee_delta = return_access_fees([scenario], daily_accesses=daily_accesses)[2] - \
+        return_access_fees([], daily_accesses=daily_accesses)[2]
+    return unique_fee_delta, access_fee_delta
+
+
+def test_a_band_crossing_matches_the_dashboard_modifiers(fee_inputs):
+    security_counter, daily_accesses, baseline = fee_inputs
+    current = baseline.latest_security_counts["Pricing"]
+    upper_bound = baseline.fee_bands["Pricing"][1][np.searchsorted(baseline.fee_bands["Pricing"][1], current)]
+    scenario = {"Scenario": "crossing", "Data Category": "Pricing", "Number of Securities": upper_bound - current + 1,
+                "Frequency per Day": 3}
+
+    result = evaluate_fee_scenarios(baseline, [scenario]).iloc[0]
+    unique_fee_delta, access_fee_delta = priced_one_at_a_time(security_counter, daily_accesses, scenario)
+
+    assert result['unique_fee_delta'] > 0 and result['access_fee_delta'] > 0
+    assert result['unique_fee_delta'] == pytest.approx(unique_fee_delta)
+    assert result['access_fee_delta'] == pytest.approx(access_fee_delta)
+
+
+def test_an_access_only_addition_leaves_unique_fees_alone(fee_inputs):
+    security_counter, daily_accesses, baseline = fee_inputs
+    # snapshot pricing has an access rate but no unique fee bands
+    scenario = {"Scenario": "snapshots", "Data Category": "Snapshot Pricing", "Number of Securities": 50,
+                "Frequency per Day": 4}
+
+    result = evaluate_fee_scenarios(baseline, [scenario]).iloc[0]
+    unique_fee_delta, access_fee_delta = priced_one_at_a_time(security_counter, daily_accesses, scenario)
+
+    assert result['unique_fee_delta'] == 0 == unique_fee_delta
+    assert result['access_fee_delta'] == pytest.approx(50 * 4 * 0.03 * baseline.remaining_business_days)
+    assert result['access_fee_delta'] == pytest.approx(access_fee_delta)
+
+
+@pytest.mark.parametrize("column", ["Number of Securities", "Frequency per Day"])
+def test_negative_scenarios_are_rejected(fee_inputs, column):
+    scenario = {"Scenario": "negative", "Data Category": "Pricing", "Number of Securities": 5, "Frequency per Day": 1,
+                column: -1}
+    with pytest.raises(ValueError, match="can't be negative"):
+        scenarios_to_frame([scenario])
+    with pytest.raises(ValueError, match="can't be negative"):
+        evaluate_fee_scenarios(fee_inputs[2], [scenario])
@@ -0,0 +1,150 @@
+from fee_schedule import load_fee_schedules, lookup_monthly_unique_fees, lookup_unique_fees_by_month, \
+    lookup_access_rates_by_month, schedule_in_effect, FEE_BANDS_PATH, ACCESS_FEE_RATES_PATH
+import fee_schedule
+import pandas as pd
+import os
+import pytest
+
+
+@pytest.fixture
+def fee_bands():
+    return load_fee_schedules()[0].fee_bands
+
+
+@pytest.fixture
+def sheet():
+    return pd.read_csv(FEE_BANDS_PATH)
+
+
+def lookup(fee_bands, data_category, count, out_of_band="raise") -> float:
+    return lookup_monthly_unique_fees(pd.Series([data_category]), pd.Series([count]), fee_bands, out_of_band)[0]
+
+
+def test_both_bounds_of_every_band_price_at_the_sheet(fee_bands, sheet):
+    for band in sheet.to_dict("records"):
+        for count in (band['Lower Bound'], band['Upper Bound']):
+            assert lookup(fee_bands, band['Data Category'], count) == pytest.approx(band['Price per annum'] / 12)
+
+
+@pytest.mark.parametrize("data_category, count", [("Security Master", 0), ("Pricing", 0), ("Derived", 7501),
+                                                  ("Security Master", 7501), ("Historical", 500),
+                                                  ("Historical", 2501)])
+def test_counts_outside_the_bands_raise(fee_bands, data_category, count):
+    with pytest.raises(ValueError, match=f"No {data_category} unique fee band covers {count} securities"):
+        lookup(fee_bands, data_category, count)
+
+
+@pytest.mark.parametrize("data_category, count, edge", [("Security Master", 0, "first"), ("Derived", 7501, "last"),
+                                                        ("Historical", 500, "first"), ("Historical", 2501, "last")])
+def test_cap_prices_counts_outside_the_bands_at_the_edge_band(fee_bands, sheet, data_category, count, edge):
+    bands = sheet.loc[sheet['Data Category'] == data_category].sort_values(by='Lower Bound')
+    edge_band = bands.iloc[0 if edge == "first" else -1]
+    assert lookup(fee_bands, data_category, count, "cap") == pytest.approx(edge_band['Price per annum'] / 12)
+
+
+def test_unknown_category_and_mode_raise(fee_bands):
+    with pytest.raises(ValueError, match="No unique fee bands for data category 'Snapshot Pricing'"):
+        lookup(fee_bands, "Snapshot Pricing", 10)
+    with pytest.raises(ValueError, match="out_of_band must be"):
+        lookup(fee_bands, "Pricing", 10, "clip")
+
+
+@pytest.fixture
+def dated_sheets(tmp_path, sheet):
+    # the shipped sheets plus a second version from april 2023 that doubles derived prices and the pricing rate
+    bands = pd.concat([sheet, sheet.loc[sheet['Data Category'] == 'Derived'].assign(
+        **{'Price per annum': lambda bands: bands['Price per annum'] * 2, 'Effective From': '2023-04-01'})])
+    rates = pd.read_csv(ACCESS_FEE_RATES_PATH)
+    rates = pd.concat([rates, pd.DataFrame({'Data Category': ['Pricing'], 'Price per Access': [0.02],
+                                            'Effective From': ['2023-04-01']})])
+
+    bands_path, rates_path = str(tmp_path / "bands.csv"), str(tmp_path / "rates.csv")
+    bands.to_csv(bands_path, index=False)
+    rates.to_csv(rates_path, index=False)
+    return bands_path, rates_path
+
+
+def test_months_are_priced_under_the_schedule_in_effect(dated_sheets):
+    fee_schedules = load_fee_schedules(*dated_sheets)
+    months = pd.Series(pd.to_datetime(["2023-03-01", "2023-04-01", "2023-05-01"]))
+    derived = pd.Series(["Derived"] * 3)
+
+    fees = lookup_unique_fees_by_month(derived, months, pd.Series([300] * 3), fee_schedules)
+    assert list(fees) == pytest.approx([1605 / 12, 3210 / 12, 3210 / 12])
+    # categories the new version leaves alone carry on at their old prices
+    assert lookup_unique_fees_by_month(pd.Series(["Pricing"] * 3), months, pd.Series([300] * 3),
+                                       fee_schedules) == pytest.approx([1070 / 12] * 3)
+
+    rates = lookup_access_rates_by_month(pd.Series(["Pricing", "Pricing", "Derived"]), months, fee_schedules)
+    assert list(rates) == pytest.approx([0.01, 0.02, 0.03])
+    assert schedule_in_effect(fee_schedules, pd.Timestamp("2023-04-15")).effective_from == pd.Timestamp("2023-04-01")
+
+
+def test_months_before_every_schedule_raise(tmp_path, sheet):
+    bands_path, rates_path = str(tmp_path / "bands.csv"), str(tmp_path / "rates.csv")
+    sheet.assign(**{'Effective From': '2023-01-01'}).to_csv(bands_path, index=False)
+    pd.read_csv(ACCESS_FEE_RATES_PATH).assign(**{'Effective From': '2023-01-01'}).to_csv(rates_path, index=False)
+
+    with pytest.raises(ValueError, match="No fee schedule in effect for 2022-12"):
+        lookup_access_rates_by_month(pd.Series(["Pricing"]), pd.Series(pd.to_datetime(["2022-12-01"])),
+                                     load_fee_schedules(bands_path, rates_path))
+
+
+@pytest.mark.parametrize("edit, message", [
+    (lambda bands: bands.drop(index=bands.index[1]), "Security Master fee bands from the start leave a gap between "
+                                                     "25 and 51"),
+    (lambda bands: bands.assign(**{'Lower Bound': bands['Lower Bound'].where(bands.index != 1, 20)}),
+     "overlap, a band starts at 20 before the one below it ends at 25"),
+    (lambda bands: bands.assign(**{'Upper Bound': bands['Upper Bound'].where(bands.index != 1, 10)}),
+     "have a band from 26 down to 10"),
+    (lambda bands: bands.assign(**{'Effective From': bands['Effective From'].where(bands.index != 0, '2023-04-15')}),
+     "effective dates must fall on the first of a month, got 2023-04-15"),
+    (lambda bands: bands.assign(**{'Lower Bound': bands['Lower Bound'].where(bands.index != 0, 1.5)}),
+     "bounds must be whole numbers"),
+    (lambda bands: bands.assign(**{'Price per annum': bands['Price per annum'].where(bands.index != 0, -1)}),
+     "prices can't be negative"),
+    (lambda bands: bands.drop(columns=['Upper Bound']), "missing the Upper Bound column"),
+])
+def test_invalid_band_sheets_raise(tmp_path, sheet, edit, message):
+    bands_path = str(tmp_path / "bands.csv")
+    edit(sheet).to_csv(bands_path, index=False)
+    with pytest.raises(ValueError, match=message):
+        load_fee_schedules(bands_path, ACCESS_FEE_RATES_PATH)
+
+
+@pytest.mark.parametrize("edit, message", [
+    (lambda rates: pd.concat([rates, rates.iloc[[0]]]), "more than one rate for the same data category"),
+    (lambda rates: rates.assign(**{'Price per Access': -0.01}), "rates can't be negative"),
+    (lambda rates: rates.assign(**{'Effective From': '2023-04-02'}), "must fall on the first of a month"),
+])
+def test_invalid_rate_sheets_raise(tmp_path, edit, message):
+    rates_path = str(tmp_path / "rates.csv")
+    edit(pd.read_csv(ACCESS_FEE_RATES_PATH)).to_csv(rates_path, index=False)
+    with pytest.raises(ValueError, match=message):
+        load_fee_schedules(FEE_BANDS_PATH, rates_path)
+
+
+def test_schedules_reload_only_when_the_contents_change(dated_sheets, monkeypatch):
+    bands_path, rates_path = dated_sheets
+    compiled = []
+    compile_fee_schedules = fee_schedule.compile_fee_schedules
+    monkeypatch.setattr(fee_schedule, "compile_fee_schedules",
+                        lambda *args: compiled.append(1) or compile_fee_schedules(*args))
+
+    first = load_fee_schedules(bands_path, rates_path)
+    assert load_fee_schedules(bands_path, rates_path) is first
+
+    # a touch moves the mtime but the hash shows nothing changed
+    stat = os.stat(bands_path)
+    os.utime(bands_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert load_fee_schedules(bands_path, rates_path) is first
+    assert len(compiled) == 1
+
+    rates = pd.read_csv(rates_path)
+    rates.loc[rates['Effective From'].notna(), 'Price per Access'] = 0.05
+    rates.to_csv(rates_path, index=False)
+    os.utime(rates_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+
+    reloaded = load_fee_schedules(bands_path, rates_path)
+    assert len(compiled) == 2
+    assert schedule_in_effect(reloaded, pd.Timestamp("2023-04-01")).access_fee_mapping['Pricing'] == 0.05
@@ -0,0 +1,52 @@
+from concurrent_loader import load_concurrently
+import profiling
+import threading
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def profiling_on(monkeypatch):
+    monkeypatch.setattr(profiling, "profiling_enabled", True)
+
+
+def record(name: str):
+    with profiling.stage(name):
+        pass
+
+
+def test_runs_only_see_their_own_stages():
+    started, finished = threading.Barrier(2), threading.Barrier(2)
+    stages = {}
+
+    def session(name: str):
+        profiling.start_run()
+        started.wait()
+        record(f"{name}.load")
+        finished.wait()
+        # the other session started its run after this one had, and recorded in between
+        stages[name] = list(profiling.last_run()['stage'])
+
+    sessions = [threading.Thread(target=session, args=(name,)) for name in ("first", "second")]
+    for thread in sessions:
+        thread.start()
+    for thread in sessions:
+        thread.join()
+
+    assert stages == {"first": ["first.load"], "second": ["second.load"]}
+
+
+def test_threads_without_a_run_record_nowhere():
+    run = profiling.start_run()
+    refresher = threading.Thread(target=record, args=("summaries.refresh",))
+    refresher.start()
+    refresher.join()
+
+    assert run == []
+
+
+def test_loader_threads_record_into_the_callers_run():
+    profiling.start_run()
+    results = dict(load_concurrently({name: lambda name=name: record(name) for name in ("unique", "access")}))
+
+    assert results.keys() == {"unique", "access"}
+    assert sorted(profiling.last_run()['stage']) == ["access", "unique"]
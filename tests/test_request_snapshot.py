@@ -0,0 +1,133 @@
+from request_snapshot import refresh_snapshot, read_snapshot, read_high_water_mark, snapshot_months
+from sqlalchemy import text
+import request_snapshot
+import sqlalchemy as sql
+import multiprocessing
+import functools
+import pandas as pd
+import threading
+import os
+
+
+def read_table(engine) -> pd.DataFrame:
+    with engine.connect() as conn:
+        return request_snapshot.normalise_types(pd.read_sql(text(request_snapshot.FULL_QUERY), conn))
+
+
+def assert_snapshot_matches_table(engine, directory):
+    snapshot = read_snapshot(directory).sort_values(by=['id']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(snapshot, read_table(engine).sort_values(by=['id']).reset_index(drop=True))
+
+
+def add_requests(engine, rows):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO requests (id, timestamp, dataset_id, success) "
+                          "VALUES (:id, :timestamp, :dataset_id, :success)"), rows)
+
+
+def test_warm_refresh_only_adds_files(writable_engine, tmp_path):
+    directory = str(tmp_path / "snapshot")
+    assert refresh_snapshot(writable_engine, directory) == 5_000
+    before = {name: os.stat(os.path.join(directory, name)).st_mtime_ns
+              for name in read_high_water_mark(directory)["files"]}
+
+    assert refresh_snapshot(writable_engine, directory) == 0
+    add_requests(writable_engine, [{"id": 5_001, "timestamp": "2023-03-31 09:00:00", "dataset_id": 1, "success": 1},
+                                   {"id": 5_002, "timestamp": "2023-04-01 09:00:00", "dataset_id": 2, "success": 0}])
+    assert refresh_snapshot(writable_engine, directory) == 2
+
+    # the files already written are left alone, the delta lands in one new file per month it touches
+    after = read_high_water_mark(directory)["files"]
+    assert {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in before} == before
+    assert len(after) == len(before) + 2
+    assert read_high_water_mark(directory)["id"] == 5_002
+    assert_snapshot_matches_table(writable_engine, directory)
+
+
+def test_rows_committed_late_under_a_lower_id_are_picked_up(writable_engine, tmp_path):
+    directory = str(tmp_path / "snapshot")
+    with writable_engine.begin() as conn:
+        late = conn.execute(text("SELECT id, timestamp, dataset_id, success FROM requests WHERE id = 4990")).mappings() \
+            .one()
+        conn.execute(text("DELETE FROM requests WHERE id = 4990"))
+
+    refresh_snapshot(writable_engine, directory, id_overlap=100)
+    add_requests(writable_engine, [dict(late)])
+    assert refresh_snapshot(writable_engine, directory, id_overlap=100) == 1
+    # the overlap reads rows already held again, they must not be stored twice
+    assert refresh_snapshot(writable_engine, directory, id_overlap=100) == 0
+    assert_snapshot_matches_table(writable_engine, directory)
+
+
+def test_compaction_merges_a_months_deltas(writable_engine, tmp_path, monkeypatch):
+    directory = str(tmp_path / "snapshot")
+    monkeypatch.setattr(request_snapshot, "COMPACT_AFTER_FILES", 3)
+    refresh_snapshot(writable_engine, directory)
+
+    for new_id in range(5_001, 5_004):
+        add_requests(writable_engine, [{"id": new_id, "timestamp": "2023-03-15 12:00:00", "dataset_id": 3,
+                                        "success": 1}])
+        refresh_snapshot(writable_engine, directory)
+
+    assert all(len(file_names) < 3 for file_names in snapshot_months(read_high_water_mark(directory)).values())
+    assert_snapshot_matches_table(writable_engine, directory)
+
+    # the merged away files are only removed on the next refresh, and never read in the meantime
+    refresh_snapshot(writable_engine, directory)
+    on_disk = {name for name in os.listdir(directory) if name.startswith("requests_")}
+    assert on_disk == set(read_high_water_mark(directory)["files"])
+
+
+def hold_lock(directory, locked, release):
+    with request_snapshot.directory_lock(directory):
+        locked.set()
+        release.wait(30)
+
+
+def refresh_in_process(database_url, directory, chunk_size):
+    # small chunks give the other processes plenty of chances to interleave their writes. this runs in a forked
+    # child, so the patch goes away with it
+    request_snapshot.fetch_new_requests = functools.partial(request_snapshot.fetch_new_requests,
+                                                            chunk_size=chunk_size)
+    refresh_snapshot(sql.create_engine(database_url), directory)
+
+
+def test_refresh_waits_for_a_lock_held_by_another_process(writable_engine, tmp_path):
+    directory = str(tmp_path / "snapshot")
+    context = multiprocessing.get_context("fork")
+    locked, release = context.Event(), context.Event()
+    holder = context.Process(target=hold_lock, args=(directory, locked, release))
+    holder.start()
+    try:
+        assert locked.wait(30)
+        refresher = threading.Thread(target=refresh_snapshot, args=(writable_engine, directory))
+        refresher.start()
+        refresher.join(1)
+        assert refresher.is_alive() and read_high_water_mark(directory) is None
+    finally:
+        release.set()
+        holder.join(30)
+
+    refresher.join(30)
+    assert_snapshot_matches_table(writable_engine, directory)
+
+
+def test_concurrent_refreshes_from_several_processes_agree(writable_engine, tmp_path):
+    directory = str(tmp_path / "snapshot")
+    refresh_snapshot(writable_engine, directory)
+    add_requests(writable_engine, [{"id": new_id, "timestamp": f"2023-0{new_id % 3 + 3}-15 12:00:00",
+                                    "dataset_id": 3, "success": 1} for new_id in range(5_001, 5_301)])
+
+    context = multiprocessing.get_context("fork")
+    refreshers = [context.Process(target=refresh_in_process, args=(str(writable_engine.url), directory, 20))
+                  for _ in range(4)]
+    for refresher in refreshers:
+        refresher.start()
+    for refresher in refreshers:
+        refresher.join(60)
+
+    assert [refresher.exitcode for refresher in refreshers] == [0, 0, 0, 0]
+    refresh_snapshot(writable_engine, directory)
+    assert_snapshot_matches_table(writable_engine, directory)
+    on_disk = {name for name in os.listdir(directory) if name.startswith("requests_")}
+    assert on_disk == set(read_high_water_mark(directory)["files"])
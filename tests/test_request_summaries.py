@@ -0,0 +1,78 @@
+from request_summaries import refresh_summaries, read_summary
+from unique_fees import build_security_counter, calculate_security_counter
+from access_fees import build_daily_accesses
+from requests_plot import count_requests_by_day
+from dataset_breakdown import compute_dataset_breakdown
+from billing_history import read_billing_history, read_opening_balances
+from data_loader import load_base_data
+from sqlalchemy import text
+import request_summaries
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def directories(tmp_path):
+    return str(tmp_path / "snapshot"), str(tmp_path / "summaries")
+
+
+def sorted_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    frame = frame.astype({column: str for column in ('data_category', 'security') if column in frame})
+    return frame.sort_values(by=list(frame.columns)).reset_index(drop=True)
+
+
+def assert_summaries_match_raw_rows(engine, summary_directory):
+    base_data = load_base_data(engine, "", False)
+
+    pd.testing.assert_frame_equal(
+        calculate_security_counter(read_summary("category_month_securities", summary_directory),
+                                   read_opening_balances(), read_billing_history()),
+        build_security_counter(base_data))
+    pd.testing.assert_frame_equal(sorted_frame(read_summary("daily_accesses", summary_directory)),
+                                  sorted_frame(build_daily_accesses(base_data, "memory")), check_dtype=False)
+    pd.testing.assert_frame_equal(sorted_frame(read_summary("request_counts", summary_directory)),
+                                  sorted_frame(count_requests_by_day(base_data)), check_dtype=False)
+    pd.testing.assert_frame_equal(
+        compute_dataset_breakdown(base_data.datasets, base_data.dataset_names,
+                                  read_summary("requested_datasets", summary_directory)['dataset_id']),
+        compute_dataset_breakdown(base_data.datasets, base_data.dataset_names, base_data.requests['dataset_id']))
+
+
+def add_requests(engine, rows):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO requests (timestamp, dataset_id, success) "
+                          "VALUES (:timestamp, :dataset_id, :success)"), rows)
+
+
+def test_incremental_refreshes_match_the_raw_rows(writable_engine, directories):
+    snapshot_directory, summary_directory = directories
+
+    assert refresh_summaries(writable_engine, snapshot_directory, summary_directory)
+    assert_summaries_match_raw_rows(writable_engine, summary_directory)
+    assert refresh_summaries(writable_engine, snapshot_directory, summary_directory) == []
+
+    # a new month, plus a late request in one already summarised, only those two are summarised again
+    add_requests(writable_engine, [{"timestamp": f"2023-06-{day:02d} 10:00:00", "dataset_id": dataset_id,
+                                    "success": 1} for day in range(1, 20) for dataset_id in (7, 8, 9)] +
+                 [{"timestamp": "2023-02-10 10:00:00", "dataset_id": 11, "success": 0}])
+    assert refresh_summaries(writable_engine, snapshot_directory, summary_directory) == ["2023-02", "2023-06"]
+    assert_summaries_match_raw_rows(writable_engine, summary_directory)
+
+
+def test_a_universe_change_summarises_every_month_again(writable_engine, directories):
+    snapshot_directory, summary_directory = directories
+    months = refresh_summaries(writable_engine, snapshot_directory, summary_directory)
+
+    with writable_engine.begin() as conn:
+        conn.execute(text("UPDATE universes SET security = 'NEW000001 Equity' WHERE id = 1"))
+    assert refresh_summaries(writable_engine, snapshot_directory, summary_directory) == months
+    assert_summaries_match_raw_rows(writable_engine, summary_directory)
+
+
+def test_a_format_bump_rebuilds_the_store(writable_engine, directories, monkeypatch):
+    snapshot_directory, summary_directory = directories
+    months = refresh_summaries(writable_engine, snapshot_directory, summary_directory)
+
+    monkeypatch.setattr(request_summaries, "SUMMARY_FORMAT", request_summaries.SUMMARY_FORMAT + 1)
+    assert refresh_summaries(writable_engine, snapshot_directory, summary_directory) == months
+    assert_summaries_match_raw_rows(writable_engine, summary_directory)
@@ -0,0 +1,53 @@
+from requests_plot import chart_frequency, downsample_request_counts, WEEKLY_AFTER_DAYS, MONTHLY_AFTER_DAYS
+import pandas as pd
+import datetime
+import pytest
+
+START = datetime.date(2023, 1, 1)
+
+
+@pytest.mark.parametrize("days, frequency", [(0, "D"), (WEEKLY_AFTER_DAYS, "D"), (WEEKLY_AFTER_DAYS + 1, "W"),
+                                             (MONTHLY_AFTER_DAYS, "W"), (MONTHLY_AFTER_DAYS + 1, "M")])
+def test_chart_frequency_thresholds(days, frequency):
+    assert chart_frequency(START, START + datetime.timedelta(days=days)) == frequency
+
+
+def request_counts(number_of_days: int, number_of_datasets: int) -> pd.DataFrame:
+    # dataset i is requested i + 1 times a day, so the busiest are the highest numbered
+    return pd.DataFrame([{"timestamp": START + datetime.timedelta(days=day), "name": f"dataset_{i:02d}",
+                          "dataset count": i + 1}
+                         for day in range(number_of_days) for i in range(number_of_datasets)])
+
+
+@pytest.mark.parametrize("number_of_days, frequency", [(30, "D"), (200, "W"), (800, "M")])
+def test_buckets_keep_the_totals_and_fold_the_tail(number_of_days, frequency):
+    counts = request_counts(number_of_days, 8)
+    downsampled = downsample_request_counts(counts, top_datasets=3)
+
+    assert downsampled['dataset count'].sum() == counts['dataset count'].sum()
+    assert set(downsampled['name']) == {"dataset_07", "dataset_06", "dataset_05", "other"}
+    assert downsampled['name'].nunique() <= 3 + 1
+    # the tail is the five quietest datasets, 1 to 5 requests a day
+    assert downsampled.loc[downsampled['name'] == "other", 'dataset count'].sum() == 15 * number_of_days
+
+    buckets = pd.to_datetime(downsampled['timestamp'])
+    assert (buckets == buckets.dt.to_period(frequency).dt.start_time).all()
+    assert downsampled['timestamp'].nunique() == pd.Series(pd.to_datetime(counts['timestamp'])).dt.to_period(
+        frequency).nunique()
+
+
+def test_weekly_buckets_add_up_each_week():
+    counts = request_counts(14, 2)
+    downsampled = downsample_request_counts(counts, START, START + datetime.timedelta(days=WEEKLY_AFTER_DAYS + 1))
+
+    # 2023-01-01 is a sunday, so it closes the week starting monday the 26th
+    weekly = downsampled.groupby('timestamp')['dataset count'].sum()
+    assert weekly.to_dict() == {datetime.date(2022, 12, 26): 3, datetime.date(2023, 1, 2): 21,
+                                datetime.date(2023, 1, 9): 18}
+
+
+def test_a_range_cuts_the_counts_down_first():
+    counts = request_counts(30, 2)
+    downsampled = downsample_request_counts(counts, START + datetime.timedelta(days=10),
+                                            START + datetime.timedelta(days=19))
+    assert downsampled['dataset count'].sum() == 10 * 3
@@ -0,0 +1,114 @@
+from unique_fees import squash_dataset_table_and_merge_with_request_table, \
+    calculate_rolling_cumulative_securities_by_month, calculate_security_counter, requests_feeding_open_months
+from billing_history import read_opening_balances, BILLING_HISTORY_COLUMNS
+import pandas as pd
+import numpy as np
+from typing import List
+import datetime
+import pytest
+
+CATEGORIES = ["Derived", "Pricing", "Security Master", "Historical"]
+
+
+def reference_security_counter(datasets: pd.DataFrame, requests: pd.DataFrame) -> pd.DataFrame:
+    # the original list of lists and iterrows version, kept here as the definition the vectorised counter must match
+    squashed = datasets.groupby(by=['data_category', 'id'])['security'].apply(list).reset_index()
+    merged = pd.merge(requests, squashed, how='inner', left_on='dataset_id', right_on='id')
+    merged['timestamp'] = merged['timestamp'].apply(lambda x: x.to_pydatetime().replace(day=1).date())
+    merged = merged.groupby(by=['data_category', 'timestamp'])['security'].apply(list).reset_index()
+    merged['security'] = merged['security'].apply(lambda lists: [security for inner in lists for security in inner])
+
+    frames = []
+    for data_category in pd.unique(merged['data_category']):
+        temp = merged.loc[merged['data_category'] == data_category].copy().sort_values(by=['timestamp']) \
+            .reset_index(drop=True)
+        for index, row in temp.iterrows():
+            securities = []
+            for i in [i for i in range(index - 3, index + 1) if i >= 0]:
+                securities.extend(temp.at[i, 'security'])
+
+            # the december security master bill carried to the end of march
+            if row['timestamp'] <= datetime.date(2023, 3, 31) and row['data_category'] == 'Security Master':
+                temp.at[index, 'number_of_cumulative_securities'] = len(set(securities)) + 2440
+            else:
+                temp.at[index, 'number_of_cumulative_securities'] = len(set(securities))
+        frames.append(temp.drop(columns=['security']))
+
+    return pd.concat(frames).reset_index(drop=True)
+
+
+def random_requests(seed: int) -> (pd.DataFrame, pd.DataFrame):
+    # datasets over a small security universe, requested on random days with whole months missing per category so
+    # the rolling window has gaps to skip over
+    rng = np.random.default_rng(seed)
+    number_of_datasets = int(rng.integers(5, 40))
+    datasets = pd.DataFrame([{"id": dataset_id, "data_category": data_category, "security": f"SEC{security}"}
+                             for dataset_id in range(1, number_of_datasets + 1)
+                             for data_category in [CATEGORIES[rng.integers(len(CATEGORIES))]]
+                             for security in rng.choice(60, int(rng.integers(1, 20)), replace=False)])
+
+    months = pd.date_range("2022-10-01", "2023-09-01", freq="MS")
+    days = pd.DatetimeIndex([day for month in months if rng.random() < 0.7
+                             for day in pd.date_range(month, month + pd.offsets.MonthEnd(0), freq="D")])
+    number_of_requests = int(rng.integers(20, 400))
+    requests = pd.DataFrame({"timestamp": days[rng.integers(len(days), size=number_of_requests)] +
+                             pd.to_timedelta(rng.integers(86400, size=number_of_requests), unit="s"),
+                             "dataset_id": rng.integers(1, number_of_datasets + 1, size=number_of_requests)})
+
+    return datasets, requests
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_rolling_counter_matches_the_iterrows_version(seed):
+    datasets, requests = random_requests(seed)
+
+    expected = reference_security_counter(datasets, requests)
+    merged = squash_dataset_table_and_merge_with_request_table(datasets, requests)
+    actual = calculate_rolling_cumulative_securities_by_month(merged, read_opening_balances())
+
+    expected = expected.astype({'number_of_cumulative_securities': 'int64'}) \
+        .sort_values(by=['data_category', 'timestamp']).reset_index(drop=True)
+    actual = actual.astype({'number_of_cumulative_securities': 'int64'}) \
+        .sort_values(by=['data_category', 'timestamp']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual[expected.columns], expected)
+
+
+def billing_history_closing(months: List[str]) -> pd.DataFrame:
+    # invoiced counts that deliberately disagree with anything the requests would give
+    return pd.DataFrame([{"Fee Type": "unique", "Data Category": data_category, "Month": pd.Timestamp(month),
+                          "Number of Securities": 100_000, "Fee": 1.0}
+                         for month in months for data_category in CATEGORIES], columns=BILLING_HISTORY_COLUMNS) \
+        .astype({"Month": "datetime64[ns]", "Fee": float})
+
+
+@pytest.mark.parametrize("seed", range(25))
+@pytest.mark.parametrize("closed", [[], ["2022-10-01", "2022-11-01", "2022-12-01"],
+                                    [f"{month:%Y-%m-%d}" for month in pd.date_range("2022-10-01", "2023-06-01",
+                                                                                    freq="MS")]])
+def test_open_months_count_the_same_from_their_windows_alone(seed, closed):
+    datasets, requests = random_requests(seed)
+    billing_history = billing_history_closing(closed)
+
+    full = calculate_rolling_cumulative_securities_by_month(
+        squash_dataset_table_and_merge_with_request_table(datasets, requests), read_opening_balances())
+    open_requests = requests_feeding_open_months(datasets, requests, pd.DatetimeIndex(closed))
+    counter = calculate_security_counter(squash_dataset_table_and_merge_with_request_table(datasets, open_requests),
+                                         read_opening_balances(), billing_history)
+
+    is_closed = pd.DatetimeIndex(counter['timestamp']).isin(pd.DatetimeIndex(closed))
+    assert (counter.loc[is_closed, 'number_of_cumulative_securities'] == 100_000).all()
+    assert is_closed.sum() == len(billing_history)
+
+    expected = full.loc[~pd.DatetimeIndex(full['timestamp']).isin(pd.DatetimeIndex(closed))].reset_index(drop=True)
+    pd.testing.assert_frame_equal(counter.loc[~is_closed].reset_index(drop=True), expected, check_dtype=False)
+
+
+def test_closed_history_outside_the_window_is_never_read():
+    datasets = pd.DataFrame({"id": [1, 2], "data_category": ["Derived", "Derived"], "security": ["A", "B"]})
+    months = pd.date_range("2022-01-01", "2022-12-01", freq="MS")
+    requests = pd.DataFrame({"timestamp": months, "dataset_id": 1})
+    closed = pd.date_range("2022-01-01", "2022-10-01", freq="MS")
+
+    # november is the first open month, its window reaches back to the three data-months before it
+    open_requests = requests_feeding_open_months(datasets, requests, closed)
+    assert list(open_requests['timestamp']) == list(pd.date_range("2022-08-01", "2022-12-01", freq="MS"))
@@ -1,133 +1,270 @@
-from creds import db_connection_string
+from data_loader import BaseData, load_base_data, successful_requests
+from billing_history import read_billing_history, read_opening_balances, closed_unique_fees, closed_months
+from fee_schedule import FeeSchedule, load_fee_schedules, lookup_unique_fees_by_month, schedule_positions
 from typing import List, Dict, Union
-from sqlalchemy import text
-import sqlalchemy as sql
+from profiling import profiled
 import pandas as pd
+import numpy as np
 import datetime
 
 global total_unique_fees
 
-
-def connect_to_dataset() -> (pd.DataFrame, pd.DataFrame):
-    engine = sql.create_engine(db_connection_string)
-
-    with engine.connect() as conn:
-        requests = pd.read_sql(text("SELECT timestamp, dataset_id from requests WHERE success = 1"), conn)
-        datasets = pd.read_sql(text(
-            "SELECT d.id as id, u.security as security, fl.data_category as data_category from datasets d "
-            "JOIN field_lists fl ON d.field_listid=fl.id JOIN universes u ON u.id=d.universeid"),
-            conn)
-
-        engine.dispose()
-
-    return requests, datasets
-
-
-def create_december_data() -> pd.DataFrame:
-    december_data = [{"data_category": "Derived", "timestamp": datetime.datetime(2022, 12, 1).date(),
-                      "number_of_cumulative_securities": 1091},
-                     {"data_category": "Pricing", "timestamp": datetime.datetime(2022, 12, 1).date(),
-                      "number_of_cumulative_securities": 199},
-                     {"data_category": "Security Master", "timestamp": datetime.datetime(2022, 12, 1).date(),
-                      "number_of_cumulative_securities": 2661},
-                     {"data_category": "Historical", "timestamp": datetime.datetime(2022, 12, 1).date(),
-                      "number_of_cumulative_securities": 1756}]
-    return pd.DataFrame(december_data)
+ROLLING_WINDOW_MONTHS = 4
+# daily growth is measured against the count this many months back, or the category's first month if it's newer
+BAND_GROWTH_LOOKBACK_MONTHS = 3
 
 
+@profiled("unique.merge")
 def squash_dataset_table_and_merge_with_request_table(datasets: pd.DataFrame, requests: pd.DataFrame) -> pd.DataFrame:
-    # squash table
-    squashed_table = datasets.groupby(by=['data_category', 'id'])['security'].apply(list).reset_index()
-
-    request_merged_table = pd.merge(requests, squashed_table, how='inner', left_on='dataset_id', right_on='id')
-
-    # create month year tag by getting first day of month
-    request_merged_table['timestamp'] = request_merged_table['timestamp'].apply(
-        lambda x: x.to_pydatetime().replace(day=1).date())
-
-    # create list of lists series
-    request_merged_table = request_merged_table.groupby(by=['data_category', 'timestamp'])['security'].apply(
-        list).reset_index()
-
-    # flatten list of securities
-    request_merged_table['security'] = request_merged_table['security'].apply(lambda x: flatten_list(x))
-
-    return request_merged_table
-
-
-def flatten_list(list_of_lists: List[List[str]]) -> List[str]:
-    new_list = []
-    for i in list_of_lists:
-        for j in i:
-            new_list.append(j)
-    return new_list
-
-
-def calculate_rolling_cumulative_securities_by_month(request_merged_table: pd.DataFrame) -> pd.DataFrame:
-    df_list = []
-    for data_category in pd.unique(request_merged_table['data_category']):
-        temp = request_merged_table.loc[request_merged_table['data_category'] == data_category].copy() \
-            .sort_values(by=['timestamp']).reset_index(drop=True)
-        for index, row in temp.iterrows():
-            cumulative_list_of_securities = []
-
-            # messy way of doing a rolling 4month period
-            for i in [i for i in range(index - 3, index + 1) if i >= 0]:
-                cumulative_list_of_securities.extend(temp.at[i, 'security'])
-
-            # add historical data, december bill for security master, hacky but necessary don't judge
-            # December data unique fees stop at the end of March so here we go
-            if row['timestamp'] <= datetime.datetime(2023, 3, 31).date() and row['data_category'] == 'Security Master':
-                temp.at[index, 'number_of_cumulative_securities'] = len(set(cumulative_list_of_securities)) + 2440
-            else:
-                temp.at[index, 'number_of_cumulative_securities'] = len(set(cumulative_list_of_securities))
-
-        temp = temp.drop(columns=['security'])
-        df_list.append(temp)
-
-    return pd.concat(df_list).reset_index(drop=True)
-
-
-def return_fee_reference_table() -> List[dict]:
-    return pd.read_csv("unique_fee_reference_sheet.csv").to_dict("records")
-
-
-def map_reference_fee_table_to_security_counter_table(security_counter: pd.DataFrame, fee_reference_table: List[dict],
-                                                      additional_category_input: Dict[str, int]) -> pd.DataFrame:
-    # fetch any modifications and add the distinct number on
-    def modify_counter(row) -> int:
-        if row['timestamp'] == max(security_counter['timestamp']):
-            number_of_secs = row['number_of_cumulative_securities'] + additional_category_input[row['data_category']]
-        else:
-            number_of_secs = row['number_of_cumulative_securities']
-
-        return number_of_secs
-
-    # fetch the price of the security counter by data category from records
-    def pull_counter_and_get_price(row) -> float:
-        return [i for i in fee_reference_table if row['data_category'] == i.get("Data Category") and (
-                i.get("Upper Bound") >= row['number_of_cumulative_securities'] >= i.get("Lower Bound"))][0].get(
-            "Price per annum") / 12
-
-    security_counter['number_of_cumulative_securities'] = security_counter.apply(modify_counter, axis=1)
-
-    # add December data
-    security_counter = pd.concat([create_december_data(), security_counter])
-    security_counter['unique_fee'] = security_counter.apply(pull_counter_and_get_price, axis=1)
+    # create month year tag and only keep one row per dataset per month before expanding into securities
+    request_months = pd.DataFrame({'dataset_id': requests['dataset_id'].to_numpy(),
+                                   'timestamp': requests['timestamp'].to_numpy().astype('datetime64[M]')})
+    request_months = request_months.drop_duplicates()
+
+    request_merged_table = pd.merge(request_months, datasets[['id', 'data_category', 'security']].drop_duplicates(),
+                                    how='inner', left_on='dataset_id', right_on='id')
+
+    # one row per distinct security seen by data category and month
+    return request_merged_table[['data_category', 'timestamp', 'security']].drop_duplicates().reset_index(drop=True)
+
+
+@profiled("unique.rolling_count")
+def calculate_rolling_cumulative_securities_by_month(
+        request_merged_table: pd.DataFrame, opening_balances: Union[pd.DataFrame, None] = None) -> pd.DataFrame:
+    # the rolling window covers the current month and the three months before it that have data for the category
+    months = request_merged_table[['data_category', 'timestamp']].drop_duplicates() \
+        .sort_values(by=['data_category', 'timestamp']).reset_index(drop=True)
+    months['month_index'] = months.groupby('data_category', observed=True).cumcount()
+    months['category_end'] = months.index - months['month_index'] + months.groupby('data_category', observed=True)[
+        'month_index'].transform('size')
+
+    sightings = pd.merge(request_merged_table, months.reset_index(names='position'), how='inner',
+                         on=['data_category', 'timestamp'])
+    security_codes = pd.factorize(sightings['security'])[0]
+    position = sightings['position'].to_numpy()
+    order = np.lexsort((position, security_codes))
+    security_codes, position = security_codes[order], position[order]
+    category_end = sightings['category_end'].to_numpy()[order]
+
+    # a sighting keeps the security in the window for the next three months, so each sighting only adds the months
+    # not already covered by the previous sighting of the same security in the same category
+    previous_position = np.full(len(position), -ROLLING_WINDOW_MONTHS)
+    same_security = (security_codes[1:] == security_codes[:-1]) & (category_end[1:] == category_end[:-1])
+    previous_position[1:][same_security] = position[:-1][same_security]
+    window_start = np.maximum(position, previous_position + ROLLING_WINDOW_MONTHS)
+    window_end = np.minimum(position + ROLLING_WINDOW_MONTHS, category_end)
+
+    covered = window_start < window_end
+    counter = np.bincount(window_start[covered], minlength=len(months) + 1) - \
+        np.bincount(window_end[covered], minlength=len(months) + 1)
+    months['number_of_cumulative_securities'] = np.cumsum(counter)[:len(months)]
+
+    if opening_balances is not None:
+        months['number_of_cumulative_securities'] += opening_balance_by_month(months, opening_balances)
+
+    # one row per category and month is left, so hand back plain labels rather than dictionary codes
+    months['data_category'] = months['data_category'].astype(str)
+    months['timestamp'] = months['timestamp'].dt.date
+
+    return months[['data_category', 'timestamp', 'number_of_cumulative_securities']].copy()
+
+
+def opening_balance_by_month(months: pd.DataFrame, opening_balances: pd.DataFrame) -> np.ndarray:
+    # securities carried in from before the request history count towards every month their balance is valid for
+    balances = pd.merge(months[['data_category', 'timestamp']].reset_index(names='position'), opening_balances,
+                        how='inner', left_on='data_category', right_on='Data Category')
+    valid = (balances['Valid From'].isna() | (balances['timestamp'] >= balances['Valid From'])) & \
+        (balances['Valid Until'].isna() | (balances['timestamp'] <= balances['Valid Until']))
+
+    return np.bincount(balances.loc[valid, 'position'], weights=balances.loc[valid, 'Number of Securities'],
+                       minlength=len(months)).astype('int64')
+
+
+@profiled("unique.band_mapping")
+def map_reference_fee_table_to_security_counter_table(
+        security_counter: pd.DataFrame, fee_schedules: List[FeeSchedule], additional_category_input: Dict[str, int],
+        out_of_band: str = "raise", billing_history: Union[pd.DataFrame, None] = None) -> pd.DataFrame:
+    # closed months are billed already, their invoiced counts and fees replace whatever the requests say
+    if billing_history is not None:
+        frozen = pd.DatetimeIndex(security_counter['timestamp']).isin(closed_months(billing_history, "unique"))
+        security_counter = security_counter.loc[~frozen].reset_index(drop=True)
+
+    # fetch any modifications and add the distinct number on to the latest month
+    latest_month = security_counter['timestamp'] == security_counter['timestamp'].max()
+    additions = security_counter['data_category'].map(additional_category_input).fillna(0)
+    security_counter['number_of_cumulative_securities'] = security_counter['number_of_cumulative_securities'] + \
+        additions.where(latest_month, 0)
+    # each month is priced under the fee schedule that was in effect for it
+    security_counter['unique_fee'] = lookup_unique_fees_by_month(security_counter['data_category'],
+                                                                 security_counter['timestamp'],
+                                                                 security_counter['number_of_cumulative_securities'],
+                                                                 fee_schedules, out_of_band)
+
+    if billing_history is not None:
+        security_counter = pd.concat([closed_unique_fees(billing_history), security_counter], ignore_index=True)
 
     return security_counter
 
 
-def return_unique_fees(additional_category_input: Union[Dict[str, int], None] = None) -> (pd.DataFrame, pd.DataFrame, float, float):
-    null_category_input = {"Derived": 0, "Pricing": 0, "Security Master": 0}
-    requests_table, datasets_table = connect_to_dataset()
-    full_request_table = squash_dataset_table_and_merge_with_request_table(datasets=datasets_table,
+@profiled("unique.modifier")
+def apply_category_additions(fee_table: pd.DataFrame, fee_schedules: List[FeeSchedule],
+                             additional_category_input: Dict[str, int], out_of_band: str = "raise") -> pd.DataFrame:
+    # only the latest month moves under a modifier, so re-price those rows of an already priced table
+    fee_table = fee_table.copy()
+    latest_month = fee_table['timestamp'] == fee_table['timestamp'].max()
+    additions = fee_table['data_category'].map(additional_category_input).fillna(0).where(latest_month, 0)
+    if not additions.any():
+        return fee_table
+
+    changed = additions != 0
+    fee_table['number_of_cumulative_securities'] = fee_table['number_of_cumulative_securities'] + additions
+    fee_table.loc[changed, 'unique_fee'] = lookup_unique_fees_by_month(
+        fee_table.loc[changed, 'data_category'], fee_table.loc[changed, 'timestamp'],
+        fee_table.loc[changed, 'number_of_cumulative_securities'], fee_schedules, out_of_band)
+
+    return fee_table
+
+
+@profiled("unique.band_headroom")
+def calculate_band_headroom(security_counter: pd.DataFrame, fee_schedules: List[FeeSchedule],
+                            as_of: Union[datetime.date, None] = None) -> pd.DataFrame:
+    # how many more securities each category and month can take before its count tips into the next, dearer band,
+    # and when the recent growth in distinct securities would take it there
+    table = security_counter[['data_category', 'timestamp', 'number_of_cumulative_securities']] \
+        .sort_values(by=['data_category', 'timestamp']).reset_index(drop=True)
+    months = pd.DatetimeIndex(table['timestamp'])
+    counts = table['number_of_cumulative_securities'].to_numpy(dtype=float)
+
+    # a month's count stands as of its last day, or as of today for the month still running, so growth is measured
+    # and crossings projected from the day the count was actually reached
+    as_of = np.datetime64(pd.Timestamp(as_of or datetime.date.today()), 'ns')
+    counted_to = np.maximum(np.minimum((months + pd.offsets.MonthEnd(0)).to_numpy(), as_of), months.to_numpy())
+    months = months.to_numpy()
+
+    # straight line growth per day from an earlier month of the same category
+    month_index = table.groupby('data_category').cumcount().to_numpy()
+    earlier = np.arange(len(table)) - np.minimum(month_index, BAND_GROWTH_LOOKBACK_MONTHS)
+    days = (counted_to - counted_to[earlier]) / np.timedelta64(1, 'D')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_growth = np.where(days > 0, (counts - counts[earlier]) / days, np.nan)
+
+    band_upper_bound = np.full(len(table), np.nan)
+    monthly_fee_increase = np.full(len(table), np.nan)
+    data_categories = table['data_category'].to_numpy()
+    positions = schedule_positions(fee_schedules, months)
+    # one sorted lookup per schedule and category, categories without bands are left empty
+    for position, data_category in set(zip(positions, data_categories)):
+        if data_category not in fee_schedules[position].fee_bands:
+            continue
+
+        lower_bounds, upper_bounds, monthly_prices = fee_schedules[position].fee_bands[data_category]
+        rows = (positions == position) & (data_categories == data_category)
+        band = np.minimum(np.searchsorted(upper_bounds, counts[rows], side='left'), len(upper_bounds) - 1)
+        band_upper_bound[rows] = upper_bounds[band]
+        # the top band has nothing above it to cross into
+        next_band = np.minimum(band + 1, len(upper_bounds) - 1)
+        monthly_fee_increase[rows] = np.where(band + 1 < len(upper_bounds),
+                                              monthly_prices[next_band] - monthly_prices[band], np.nan)
+
+    headroom = band_upper_bound - counts
+    crossing = (daily_growth > 0) & ~np.isnan(monthly_fee_increase)
+    # one past the headroom is the first security billed in the next band
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_to_crossing = np.ceil((headroom + 1) / daily_growth)
+    projected_crossing = counted_to + np.where(crossing, days_to_crossing, 0).astype('timedelta64[D]')
+
+    return pd.DataFrame({'data_category': table['data_category'],
+                         'timestamp': table['timestamp'],
+                         'counted_to': counted_to,
+                         'number_of_cumulative_securities': table['number_of_cumulative_securities'],
+                         'band_upper_bound': band_upper_bound,
+                         'headroom': headroom,
+                         'daily_growth': daily_growth,
+                         'projected_crossing': np.where(crossing, projected_crossing, np.datetime64('NaT')),
+                         'monthly_fee_increase': monthly_fee_increase})
+
+
+def open_window_starts(category_months: pd.DataFrame, closed: pd.DatetimeIndex) -> pd.DataFrame:
+    # the earliest month each category's rolling window reaches back to from its first month that isn't closed,
+    # nothing seen before it can change an open month's count. categories with every month closed are left out
+    months = category_months[['data_category', 'timestamp']].drop_duplicates() \
+        .sort_values(by=['data_category', 'timestamp']).reset_index(drop=True)
+    months['month_index'] = months.groupby('data_category', observed=True).cumcount()
+    is_open = ~pd.DatetimeIndex(months['timestamp']).isin(closed)
+    first_open = months.loc[is_open].groupby('data_category', observed=True)['month_index'].min()
+
+    window_start = (first_open - (ROLLING_WINDOW_MONTHS - 1)).clip(lower=0).rename('month_index').reset_index()
+    window_start = pd.merge(window_start, months, how='inner', on=['data_category', 'month_index'])
+    return window_start[['data_category', 'timestamp']].rename(columns={'timestamp': 'window_start'})
+
+
+def restrict_to_open_windows(table: pd.DataFrame, window_starts: pd.DataFrame) -> pd.DataFrame:
+    table = pd.merge(table, window_starts, how='inner', on='data_category')
+    return table.loc[table['timestamp'] >= table['window_start']].drop(columns=['window_start']) \
+        .reset_index(drop=True)
+
+
+@profiled("unique.open_window")
+def requests_feeding_open_months(datasets: pd.DataFrame, requests: pd.DataFrame,
+                                 closed: pd.DatetimeIndex) -> pd.DataFrame:
+    # one row per dataset and month, cut down to the months an open month's window reads before anything is fanned
+    # out to securities, so the cost follows the open months rather than the whole history
+    request_months = pd.DataFrame({'dataset_id': requests['dataset_id'].to_numpy(),
+                                   'timestamp': requests['timestamp'].to_numpy().astype('datetime64[M]')})
+    request_months = pd.merge(request_months.drop_duplicates(),
+                              datasets[['id', 'data_category']].drop_duplicates(subset=['id']),
+                              how='inner', left_on='dataset_id', right_on='id')
+
+    request_months = restrict_to_open_windows(request_months, open_window_starts(request_months, closed))
+    return request_months[['dataset_id', 'timestamp']]
+
+
+def calculate_security_counter(request_merged_table: pd.DataFrame, opening_balances: pd.DataFrame,
+                               billing_history: pd.DataFrame) -> pd.DataFrame:
+    # closed months are taken as invoiced and never recounted, only the open months are counted, from the sightings
+    # their rolling windows cover
+    closed = closed_months(billing_history, "unique")
+    sightings = restrict_to_open_windows(request_merged_table, open_window_starts(request_merged_table, closed))
+    security_counter = calculate_rolling_cumulative_securities_by_month(sightings, opening_balances)
+    security_counter = security_counter.loc[~pd.DatetimeIndex(security_counter['timestamp']).isin(closed)]
+
+    closed_counts = closed_unique_fees(billing_history).drop(columns=['unique_fee'])
+    return pd.concat([closed_counts, security_counter], ignore_index=True) \
+        .sort_values(by=['data_category', 'timestamp']).reset_index(drop=True)
+
+
+def build_security_counter(base_data: Union[BaseData, None] = None,
+                           billing_history: Union[pd.DataFrame, None] = None) -> pd.DataFrame:
+    if base_data is None:
+        base_data = load_base_data()
+    if billing_history is None:
+        billing_history = read_billing_history()
+
+    requests_table = requests_feeding_open_months(base_data.datasets, successful_requests(base_data),
+                                                  closed_months(billing_history, "unique"))
+    full_request_table = squash_dataset_table_and_merge_with_request_table(datasets=base_data.datasets,
                                                                            requests=requests_table)
-    unique_fee_table = calculate_rolling_cumulative_securities_by_month(full_request_table)
+    return calculate_security_counter(full_request_table, read_opening_balances(), billing_history)
 
-    final_fee_table = map_reference_fee_table_to_security_counter_table(unique_fee_table.copy(),
-                                                                        return_fee_reference_table(),
-                                                                        null_category_input)
+
+@profiled("unique.total")
+def return_unique_fees(additional_category_input: Union[Dict[str, int], None] = None,
+                       base_data: Union[BaseData, None] = None,
+                       security_counter: Union[pd.DataFrame, None] = None,
+                       billing_history: Union[pd.DataFrame, None] = None) -> (
+        pd.DataFrame, pd.DataFrame, float, float, pd.DataFrame, pd.DataFrame):
+    null_category_input = {"Derived": 0, "Pricing": 0, "Security Master": 0}
+    # the rolling counter is the expensive part, callers holding a cached one skip straight to pricing
+    # callers pricing an earlier period pass the history as it stood then, so later invoices stay out of it
+    if billing_history is None:
+        billing_history = read_billing_history()
+    unique_fee_table = security_counter if security_counter is not None else build_security_counter(base_data,
+                                                                                                    billing_history)
+    fee_schedules = load_fee_schedules()
+
+    final_fee_table = map_reference_fee_table_to_security_counter_table(unique_fee_table.copy(), fee_schedules,
+                                                                        null_category_input,
+                                                                        billing_history=billing_history)
     # categories specified to return
     if additional_category_input is not None:
         # negatives are not allowed
@@ -135,70 +272,45 @@ def return_unique_fees(additional_category_input: Union[Dict[str, int], None] =
     else:
         additional_category_input = null_category_input
 
-    additional_fee_table = map_reference_fee_table_to_security_counter_table(unique_fee_table.copy(),
-                                                                             return_fee_reference_table(),
-                                                                             additional_category_input)
+    additional_fee_table = apply_category_additions(final_fee_table, fee_schedules, additional_category_input)
 
     final_fee_table, unique_fees_total, additional_fees = compare_fee_changes(final_fee_table, additional_fee_table)
 
-    unique_fee_table_without_number_of_secs = final_fee_table.drop(columns=['number_of_cumulative_securities'])
-    unique_fee_table_without_number_of_secs = pivot_table_fee(unique_fee_table_without_number_of_secs).fillna("$0.00")
+    # numeric pivots, formatting is left to whoever displays them
+    unique_fee_pivot = pivot_table_fee(final_fee_table)
+    additional_unique_fee_pivot = pivot_table_fee(final_fee_table, values='additional_unique_fee')
 
     # get number of securities
-    final_fee_table = final_fee_table[['timestamp', 'data_category', 'number_of_cumulative_securities']].copy()
-    final_fee_table = pivot_table_sec_number(final_fee_table).fillna(0)
+    security_number_pivot = pivot_table_sec_number(final_fee_table)
+    additional_security_number_pivot = pivot_table_sec_number(final_fee_table, values='additional_securities')
 
-    if additional_fees:
-        return unique_fee_table_without_number_of_secs, final_fee_table, unique_fees_total, additional_fees - unique_fees_total
-    else:
-        return unique_fee_table_without_number_of_secs, final_fee_table, unique_fees_total, 0
+    return unique_fee_pivot, security_number_pivot, unique_fees_total, additional_fees, \
+        additional_unique_fee_pivot, additional_security_number_pivot
 
 
-def pivot_table_fee(table: pd.DataFrame):
-    return pd.pivot_table(table, values="unique_fee", index="data_category", columns='timestamp',
-                          aggfunc=lambda i: ''.join(i))
+def pivot_table_fee(table: pd.DataFrame, values: str = "unique_fee"):
+    return pd.pivot_table(table.assign(timestamp=table['timestamp'].astype(str)), values=values,
+                          index="data_category", columns='timestamp', aggfunc='sum', fill_value=0)
 
 
-def pivot_table_sec_number(table: pd.DataFrame):
-    table['timestamp'] = table['timestamp'].astype(str)
-    return pd.pivot_table(table, values="number_of_cumulative_securities", index="data_category", columns='timestamp',
-                          aggfunc=lambda i: ''.join(i))
+def pivot_table_sec_number(table: pd.DataFrame, values: str = "number_of_cumulative_securities"):
+    return pd.pivot_table(table.assign(timestamp=table['timestamp'].astype(str)), values=values,
+                          index="data_category", columns='timestamp', aggfunc='sum', fill_value=0)
 
 
+@profiled("unique.compare")
 def compare_fee_changes(current_fee_table: pd.DataFrame, additional_fee_table: pd.DataFrame) -> (pd.DataFrame, float, float):
-    unique_fees = sum(current_fee_table['unique_fee'])
-    if current_fee_table.equals(additional_fee_table):
-        current_fee_table['number_of_cumulative_securities'] = current_fee_table[
-            'number_of_cumulative_securities'].apply(lambda i: f"{i:.0f}")
-        current_fee_table['unique_fee'] = current_fee_table['unique_fee'].apply(lambda i: f"${i:,.2f}")
-        return current_fee_table, unique_fees, 0
-
-    current_fee_table_temp = current_fee_table.copy()
-    additional_fee_table_temp = additional_fee_table.copy()
-
-    # sum new fees
-    additional_fees = sum(additional_fee_table['unique_fee'])
-
-    combined_fee_table = pd.merge(current_fee_table_temp, additional_fee_table_temp, how='inner',
-                                  right_on=['data_category', 'timestamp'],
-                                  left_on=['data_category', 'timestamp'])
-
-    def track_differences_and_concat_strings_number_of_secs(row):
-        if row['number_of_cumulative_securities_x'] != row['number_of_cumulative_securities_y']:
-            return f"{int(row['number_of_cumulative_securities_x'])} + {int(row['number_of_cumulative_securities_y'] - row['number_of_cumulative_securities_x'])}"
-        else:
-            return f"{int(row['number_of_cumulative_securities_x'])}"
-
-    def track_differences_and_concat_strings_fees(row):
-        if row['unique_fee_x'] != row['unique_fee_y']:
-            return f"${row['unique_fee_x']:,.2f} + ${row['unique_fee_y'] - row['unique_fee_x']:,.2f}"
-        else:
-            return f"${row['unique_fee_x']:,.2f}"
-
-    combined_fee_table['number_of_cumulative_securities'] = combined_fee_table.apply(
-        track_differences_and_concat_strings_number_of_secs, axis=1)
-    combined_fee_table['unique_fee'] = combined_fee_table.apply(
-        track_differences_and_concat_strings_fees, axis=1)
-
-    return combined_fee_table[['data_category', 'timestamp', 'number_of_cumulative_securities',
-                               'unique_fee']].copy(), unique_fees, additional_fees
+    unique_fees = current_fee_table['unique_fee'].sum()
+
+    # keep the baseline numbers and carry what the modifier adds on top as separate numeric columns
+    combined_fee_table = pd.merge(current_fee_table, additional_fee_table[
+        ['data_category', 'timestamp', 'number_of_cumulative_securities', 'unique_fee']], how='inner',
+                                  on=['data_category', 'timestamp'], suffixes=('', '_with_additions'))
+    combined_fee_table['additional_securities'] = combined_fee_table['number_of_cumulative_securities_with_additions'] \
+        - combined_fee_table['number_of_cumulative_securities']
+    combined_fee_table['additional_unique_fee'] = combined_fee_table['unique_fee_with_additions'] - \
+        combined_fee_table['unique_fee']
+
+    return combined_fee_table[['data_category', 'timestamp', 'number_of_cumulative_securities', 'unique_fee',
+                               'additional_securities', 'additional_unique_fee']].copy(), unique_fees, \
+        combined_fee_table['additional_unique_fee'].sum()